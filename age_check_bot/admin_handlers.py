@@ -6,6 +6,7 @@ from telegram import (
 )
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
+from config import CHANNELS
 from decorators import admin_only
 from db import (
     add_admin,
@@ -13,11 +14,28 @@ from db import (
     get_admins,
     is_admin,
     get_all_ads,
-    get_scheduled_broadcasts,
+    get_recurring_campaigns_page,
+    count_recurring_campaigns,
+    remove_recurring_campaign,
+    get_pending_broadcasts,
+    count_pending_broadcasts,
     remove_scheduled_broadcast,
     remove_all_scheduled_broadcasts,
 )
-from bot_handlers import admin_states, generate_repeated_broadcasts
+from bot_handlers import (
+    admin_states,
+    admin_channels,
+    get_admin_channel,
+    ask_drip_window,
+    describe_admin_channel,
+    generate_repeated_broadcasts,
+)
+from chat_join_handler import approve_confirmed_backlog
+from profiles import profiles
+from progress import active_broadcasts
+
+# Кампаний на одной странице расписания
+SCHEDULE_PAGE_SIZE = 10
 
 
 async def admin_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -47,15 +65,24 @@ async def show_main_admin_panel(update_or_query, context: ContextTypes.DEFAULT_T
         [InlineKeyboardButton("📢 Реклама", callback_data="admin_ads")],
         [InlineKeyboardButton("👥 Админы", callback_data="admin_admins")],
         [InlineKeyboardButton("📤 Рассылка", callback_data="admin_broadcast")],
-        [InlineKeyboardButton("🖼 Превью", callback_data="admin_preview")]
+        [InlineKeyboardButton("🖼 Превью", callback_data="admin_preview")],
+        [InlineKeyboardButton("✅ Одобрить заявки", callback_data="approve_backlog")]
     ]
+    text = "⚙️ Админ-панель"
+
+    # Превью и рассылки относятся к выбранному каналу
+    if len(CHANNELS) > 1:
+        channel_id = await get_admin_channel(user.id)
+        name = await profiles.get_name(context.bot, channel_id)
+        keyboard.insert(0, [InlineKeyboardButton(f"📡 Канал: {name}", callback_data="select_channel")])
+        text += f"\n📡 Канал: {name}"
 
     markup = InlineKeyboardMarkup(keyboard)
 
     if hasattr(update_or_query, "message") and update_or_query.message:
-        await update_or_query.message.reply_text("⚙️ Админ-панель", reply_markup=markup)
+        await update_or_query.message.reply_text(text, reply_markup=markup)
     else:
-        await update_or_query.edit_message_text("⚙️ Админ-панель", reply_markup=markup)
+        await update_or_query.edit_message_text(text, reply_markup=markup)
 
 
 @admin_only
@@ -73,6 +100,29 @@ async def admin_inline_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     if data == "admin_main":
         await show_main_admin_panel(query, context)
 
+    elif data == "select_channel":
+        names = await profiles.get_names(context.bot, list(CHANNELS))
+        keyboard = [[InlineKeyboardButton(names[chat_id], callback_data=f"channel_{chat_id}")]
+                    for chat_id in CHANNELS]
+        keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data="admin_main")])
+        await query.edit_message_text("📡 Выберите канал:", reply_markup=InlineKeyboardMarkup(keyboard))
+
+    elif data.startswith("channel_"):
+        chat_id = int(data.split("_", 1)[1])
+        if chat_id in CHANNELS:
+            await admin_channels.set(user_id, chat_id)
+        await show_main_admin_panel(query, context)
+
+    elif data.startswith(("bc_pause_", "bc_resume_", "bc_cancel_")):
+        # bc_<действие>_<token> — управление идущей рассылкой из сообщения с прогрессом
+        _, action, token = data.split("_")
+        progress = active_broadcasts.get(token)
+        if progress is None:
+            # Рассылка уже закончилась (или бот перезапущен) — кнопки больше не нужны
+            await query.edit_message_reply_markup(reply_markup=None)
+        else:
+            getattr(progress, action)()
+
     elif data == "admin_ads":
         keyboard = [
             [InlineKeyboardButton("➕ Добавить", callback_data="add_ad")],
@@ -88,15 +138,15 @@ async def admin_inline_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         await show_ad_list(query, context)
 
     elif data == "search_ad":
-        admin_states[user_id] = "search_ad"
+        await admin_states.set(user_id, "search_ad")
         await query.edit_message_text("🔍 Введите ID рекламы для просмотра:")
 
     elif data == "delete_ad":
-        admin_states[user_id] = "delete_ad"
+        await admin_states.set(user_id, "delete_ad")
         await query.edit_message_text("🗑 Введите ID рекламы для удаления:")
 
     elif data == "add_ad":
-        admin_states[user_id] = "broadcast_new"
+        await admin_states.set(user_id, "broadcast_new")
         await query.edit_message_text("📷 Пришлите фото с подписью.\n(Реклама сохранится в базе)")
 
     elif data == "admin_admins":
@@ -111,14 +161,8 @@ async def admin_inline_handler(update: Update, context: ContextTypes.DEFAULT_TYP
 
     elif data == "list_admins":
         admins = await get_admins()
-        lines = []
-        for admin_id in admins:
-            try:
-                user = await context.bot.get_chat(admin_id)
-                name = f"@{user.username}" if user.username else f"{user.full_name} ({admin_id})"
-            except Exception:
-                name = str(admin_id)
-            lines.append(f"👤 {name}")
+        names = await profiles.get_names(context.bot, admins)
+        lines = [f"👤 {names[admin_id]}" for admin_id in admins]
 
         text = "\n".join(lines) or "Нет администраторов."
         keyboard = [[InlineKeyboardButton(
@@ -126,20 +170,14 @@ async def admin_inline_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         await query.edit_message_text(f"👥 Администраторы:\n{text}", reply_markup=InlineKeyboardMarkup(keyboard))
 
     elif data == "add_admin":
-        admin_states[user_id] = "add_admin_manual"
+        await admin_states.set(user_id, "add_admin_manual")
         await query.edit_message_text("Введите ID пользователя, которого нужно добавить в админы:")
 
     elif data == "select_remove_admin":
         admins = await get_admins()
-        keyboard = []
-        for uid in admins:
-            try:
-                user = await context.bot.get_chat(uid)
-                label = f"@{user.username}" if user.username else f"{user.full_name} ({uid})"
-            except Exception:
-                label = str(uid)
-            keyboard.append([InlineKeyboardButton(
-                label, callback_data=f"remove_admin_{uid}")])
+        names = await profiles.get_names(context.bot, admins)
+        keyboard = [[InlineKeyboardButton(names[uid], callback_data=f"remove_admin_{uid}")]
+                    for uid in admins]
         keyboard.append([InlineKeyboardButton(
             "⬅️ Назад", callback_data="admin_admins")])
         await query.edit_message_text("Выберите админа для удаления:", reply_markup=InlineKeyboardMarkup(keyboard))
@@ -174,41 +212,51 @@ async def admin_inline_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         await query.edit_message_text("🧹 Все рассылки удалены.")
 
     elif data == "duration_custom":
-        state = admin_states.get(user_id)
+        state = await admin_states.get(user_id)
         if not state:
             await query.edit_message_text("⚠️ Сессия устарела. Начните заново.")
             return
         state["awaiting_custom_days"] = True
+        await admin_states.set(user_id, state)
         await query.edit_message_text("✍️ Введите количество дней (целое число):")
 
     elif data.startswith("duration_days_"):
-        state = admin_states.get(user_id)
+        state = await admin_states.get(user_id)
         if not state:
             await query.edit_message_text("⚠️ Сессия устарела. Начните заново.")
             return
         days = int(data.split("_")[-1])
         state["duration_days"] = days
+        await admin_states.set(user_id, state)
+        await ask_drip_window(update, context)
+
+    elif data.startswith("drip_"):
+        state = await admin_states.get(user_id)
+        if not isinstance(state, dict) or not state.get("duration_days"):
+            await query.edit_message_text("⚠️ Сессия устарела. Начните заново.")
+            return
+        state["drip_minutes"] = int(data.split("_")[-1])
         await generate_repeated_broadcasts(update, context, state)
-        admin_states.pop(user_id, None)
+        await admin_states.pop(user_id)
 
     elif data.startswith("repeat_every_"):
         hours = int(data.split("_")[-1])
-        state = admin_states.get(user_id, {})
+        state = await admin_states.get(user_id) or {}
         state["repeat_every_hours"] = hours
-        admin_states[user_id] = state
+        await admin_states.set(user_id, state)
         await query.edit_message_text(
             f"🔁 Рассылка каждые {hours} ч.\n📅 Введите дату и время ПЕРВОЙ рассылки:\n<YYYY-MM-DD HH:MM>"
         )
 
     elif data == "repeat_custom":
-        state = admin_states.get(user_id, {})
+        state = await admin_states.get(user_id) or {}
         state["awaiting_custom_repeat"] = True
-        admin_states[user_id] = state
+        await admin_states.set(user_id, state)
         await query.edit_message_text("✍️ Введите кастомный период в часах (например, 36)")
 
     elif data.startswith("schedule_ad_"):
         ad_id = int(data.split("_")[-1])
-        admin_states[user_id] = {"schedule_selected_ad": ad_id}
+        await admin_states.set(user_id, {"schedule_selected_ad": ad_id})
         keyboard = [
             [InlineKeyboardButton(
                 "⏱ Каждые 6 ч", callback_data="repeat_every_6")],
@@ -229,7 +277,7 @@ async def admin_inline_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         if not ads:
             await query.edit_message_text("📭 Нет рекламы для рассылки.")
             return
-        admin_states[user_id] = "schedule_select_ad"
+        await admin_states.set(user_id, "schedule_select_ad")
         keyboard = []
         for ad_id, text in ads:
             preview = text[:30].replace('\n', ' ')
@@ -237,83 +285,115 @@ async def admin_inline_handler(update: Update, context: ContextTypes.DEFAULT_TYP
                 f"🆔 {ad_id}: {preview}...", callback_data=f"schedule_ad_{ad_id}")])
         keyboard.append([InlineKeyboardButton(
             "⬅️ Назад", callback_data="admin_broadcast")])
-        await query.edit_message_text("📋 Выберите рекламу для рассылки:", reply_markup=InlineKeyboardMarkup(keyboard))
-
-    elif data == "scheduled_list":
-        scheduled = await get_scheduled_broadcasts()
-        if not scheduled:
-            await query.edit_message_text("📭 Нет запланированных рассылок.")
-            return
-        keyboard = [
-            [InlineKeyboardButton(
-                "🗑 Удалить все", callback_data="scheduled_remove_all")]
-        ]
-        text_lines = []
-        for b_id, text, _, send_at in scheduled:
-            short = text[:30].replace("\n", " ")
-            text_lines.append(f"🆔 #{b_id} — {send_at}\n📝 {short}")
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"🗑 Удалить #{b_id}", callback_data=f"scheduled_remove_{b_id}")
-            ])
-        keyboard.append([InlineKeyboardButton(
-            "⬅️ Назад", callback_data="admin_broadcast")])
-        await query.edit_message_text("📤 Запланированные:\n\n" + "\n\n".join(text_lines),
+        channel = await describe_admin_channel(context.bot, user_id)
+        await query.edit_message_text(f"📋 Выберите рекламу для рассылки:{channel}",
                                       reply_markup=InlineKeyboardMarkup(keyboard))
 
-    elif data.startswith("scheduled_remove_"):
-        ad_id = int(data.split("_")[-1])
-        await remove_scheduled_broadcast(ad_id)
+    elif data.startswith(("campaign_remove_", "broadcast_remove_")):
+        item_id = int(data.split("_")[-1])
+        if data.startswith("campaign_"):
+            await remove_recurring_campaign(item_id)
+            text = f"🗑 Кампания #{item_id} удалена."
+        else:
+            await remove_scheduled_broadcast(item_id)
+            text = f"🗑 Разовая рассылка #{item_id} удалена."
         keyboard = [[InlineKeyboardButton(
             "⬅️ Назад к списку", callback_data="scheduled_list")]]
-        await query.edit_message_text(f"🗑 Рассылка #{ad_id} удалена.",
-                                      reply_markup=InlineKeyboardMarkup(keyboard))
+        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
-    elif data.startswith("scheduled_list"):
-        page = int(data.split("_")[-1]) if "_" in data else 0
-        scheduled = await get_scheduled_broadcasts()
+    elif data.startswith("scheduled_remove_"):
+        # Кнопка из старого списка: неясно, рассылка это или кампания — ничего не удаляем
+        keyboard = [[InlineKeyboardButton(
+            "📅 Расписание", callback_data="scheduled_list")]]
+        await query.edit_message_text("⚠️ Кнопка устарела, откройте расписание заново.",
+                                      reply_markup=InlineKeyboardMarkup(keyboard))
 
-        if not scheduled:
+    elif data == "scheduled_list" or data.startswith("scheduled_list_"):
+        # scheduled_list_<стр.>[_a|b<next_at>_<id>] — ключ соседней страницы для keyset-запроса
+        page, after, before = 0, None, None
+        parts = data.split("_")[2:]
+        if parts:
+            page = int(parts[0])
+        if len(parts) == 3:
+            key = (parts[1][1:], int(parts[2]))
+            if parts[1].startswith("a"):
+                after = key
+            else:
+                before = key
+
+        total = await count_recurring_campaigns()
+        # Разовые рассылки (в том числе созданные до перехода на кампании) — на первой странице
+        pending_total = await count_pending_broadcasts() if page == 0 else 0
+        if not total and not pending_total:
             await query.edit_message_text("📭 Нет запланированных рассылок.")
             return
 
-        per_page = 10
-        total_pages = (len(scheduled) + per_page - 1) // per_page
-        start = page * per_page
-        end = start + per_page
-        items = scheduled[start:end]
+        per_page = SCHEDULE_PAGE_SIZE
+        total_pages = max((total + per_page - 1) // per_page, 1)
+        items, has_more = [], False
+        if total:
+            items, has_more = await get_recurring_campaigns_page(per_page, after=after, before=before)
+            if not items:
+                # Страница опустела (кампании удалены или уже отработали) — с начала списка
+                page, before = 0, None
+                items, has_more = await get_recurring_campaigns_page(per_page)
+        page = min(page, total_pages - 1)
+        pending = await get_pending_broadcasts(per_page) if pending_total else []
 
-        keyboard = []
-
-        for b_id, text, image_path, send_at in items:
-            short_text = text[:30].replace("\n", " ").strip()
+        keyboard = [[InlineKeyboardButton(
+            "🗑 Удалить все", callback_data="scheduled_remove_all")]]
+        for c_id, *_ in items:
             keyboard.append([InlineKeyboardButton(
-                f"🗑 Удалить #{b_id}", callback_data=f"scheduled_remove_{b_id}"
+                f"🗑 Удалить кампанию #{c_id}", callback_data=f"campaign_remove_{c_id}"
+            )])
+        for b_id, *_ in pending:
+            keyboard.append([InlineKeyboardButton(
+                f"🗑 Удалить рассылку #{b_id}", callback_data=f"broadcast_remove_{b_id}"
             )])
 
-        nav_buttons = []
-        if page > 0:
-            nav_buttons.append(InlineKeyboardButton(
-                "◀️ Назад", callback_data=f"scheduled_list_{page-1}"))
-        if page < total_pages - 1:
-            nav_buttons.append(InlineKeyboardButton(
-                "▶️ Вперёд", callback_data=f"scheduled_list_{page+1}"))
-
-        if nav_buttons:
-            keyboard.append(nav_buttons)
+        if items:
+            first, last = items[0], items[-1]
+            has_next = has_more if before is None else page < total_pages - 1
+            nav_buttons = []
+            if page > 0:
+                nav_buttons.append(InlineKeyboardButton(
+                    "◀️ Назад", callback_data=f"scheduled_list_{page-1}_b{first[3]}_{first[0]}"))
+            if has_next:
+                nav_buttons.append(InlineKeyboardButton(
+                    "▶️ Вперёд", callback_data=f"scheduled_list_{page+1}_a{last[3]}_{last[0]}"))
+            if nav_buttons:
+                keyboard.append(nav_buttons)
 
         keyboard.append([InlineKeyboardButton(
             "⬅️ Назад", callback_data="admin_broadcast")])
-        keyboard.insert(0, [InlineKeyboardButton(
-            "🗑 Удалить все", callback_data="scheduled_remove_all")])
 
+        channel_names = await profiles.get_names(context.bot, list(CHANNELS)) if len(CHANNELS) > 1 else {}
         message_text = f"📤 Запланированные рассылки (стр. {page+1}/{total_pages}):\n\n"
-        for b_id, text, image_path, send_at in items:
-            short_text = text[:30].replace("\n", " ").strip()
-            message_text += f"🆔 #{b_id} — {send_at}\n📝 {short_text}\n\n"
+        for c_id, channel_id, hours, next_at, end_at, drip_minutes, short_text in items:
+            drip = f", плавно за {drip_minutes} мин" if drip_minutes else ""
+            channel = f" [{channel_names.get(channel_id, channel_id)}]" if channel_names else ""
+            message_text += (f"🔁 Кампания #{c_id}{channel} — каждые {hours} ч{drip}, след. {next_at} (до {end_at})\n"
+                             f"📝 {short_text or ''}\n\n")
+        if pending:
+            message_text += f"📌 Разовые рассылки ({pending_total}):\n\n"
+        for b_id, channel_id, send_at, drip_minutes, short_text in pending:
+            drip = f", плавно за {drip_minutes} мин" if drip_minutes else ""
+            channel = f" [{channel_names.get(channel_id, channel_id)}]" if channel_names else ""
+            message_text += f"🆔 #{b_id}{channel} — {send_at}{drip}\n📝 {short_text or ''}\n\n"
+        if pending_total > len(pending):
+            message_text += f"… и ещё {pending_total - len(pending)} — удаляются через «Удалить все»\n"
 
         await query.edit_message_text(message_text.strip(), reply_markup=InlineKeyboardMarkup(keyboard))
 
+    elif data == "approve_backlog":
+        await query.edit_message_text("⏳ Одобряю заявки подтвердивших пользователей...")
+        approved, failed = await approve_confirmed_backlog(context.bot)
+        keyboard = [[InlineKeyboardButton("⬅️ Назад", callback_data="admin_main")]]
+        await query.edit_message_text(
+            f"✅ Одобрено заявок: {approved}, ошибок: {failed}",
+            reply_markup=InlineKeyboardMarkup(keyboard))
+
     elif data == "admin_preview":
-        admin_states[user_id] = "preview_upload"
-        await query.message.reply_text("✏️ Отправьте новое превью (фото и/или текст).")
\ No newline at end of file
+        await admin_states.set(user_id, "preview_upload")
+        channel = await describe_admin_channel(context.bot, user_id)
+        await query.message.reply_text(f"✏️ Отправьте новое превью (фото и/или текст).{channel}")
\ No newline at end of file
@@ -1,25 +1,101 @@
-import os
 import asyncio
+import html
+import time
+
 from telegram import (Update, ReplyKeyboardMarkup,
                       InlineKeyboardMarkup, InlineKeyboardButton,
                       ReplyKeyboardRemove)
 from telegram.ext import ContextTypes
-from config import CHANNEL_ID, MEDIA_FOLDER
+from config import CHANNELS, CONFIRM_DEBOUNCE_SECONDS, DEFAULT_CHANNEL_ID
 from db import (
     add_user,
     add_admin,
     get_ad,
     get_all_ads,
-    get_confirmed_users,
+    iter_confirmed_users,
+    is_user_confirmed_anywhere,
+    count_confirmed_users,
     is_admin as db_is_admin,
     remove_ad,
     get_preview,
     set_preview,
     add_ad_get_id,
+    reactivate_user,
+    remove_join_requests,
 )
-from utils import send_ad_to_user
+from broadcast import BroadcastControl
+from chat_join_handler import approve_pending_join, get_user_channels, set_join_listener
+from invite_pool import invite_pools
+from log import get_logger
+from media import ingest_photo, store_in_background
+from metrics import instrument_handler
+from profiles import profiles
+from progress import BroadcastProgress
+from state_store import create_state_store
+from utils import broadcast_ad, send_ad_to_user, send_media
+
+log = get_logger("bot_handlers")
+admin_states = create_state_store()
+
+# Канал, с которым работает админ (превью, рассылки); по умолчанию — первый из CHANNELS.
+# Отдельное хранилище без TTL: выбор канала не должен молча сбрасываться на канал
+# по умолчанию, как брошенный диалог в admin_states
+admin_channels = create_state_store(table="admin_channels", ttl=0)
+
+
+async def get_admin_channel(user_id: int) -> int:
+    channel_id = await admin_channels.get(user_id)
+    return channel_id if channel_id in CHANNELS else DEFAULT_CHANNEL_ID
+
+
+async def describe_admin_channel(bot, user_id: int) -> str:
+    """Строка «📡 Канал: …» для подсказок админу (пусто, если канал один)."""
+    if len(CHANNELS) < 2:
+        return ""
+    name = await profiles.get_name(bot, await get_admin_channel(user_id))
+    return f"\n📡 Канал: {name}"
+
+
+# Задержки сообщений после подтверждения возраста (сек)
+INVITE_LINK_DELAY = 3.0
+MODERATION_WARNING_DELAY = 5.0
+
+# user_id -> (время подтверждения, {канал: выданная ссылка, True — заявка одобрена,
+# None — ещё обрабатывается}, каналы новых заявок). Пока запись свежая, повторные
+# нажатия в течение CONFIRM_DEBOUNCE_SECONDS отвечаются из памяти, без запросов
+# к базе и API; заявка в новый канал (set_join_listener) обрабатывается как обычно.
+# Порядок вставки совпадает с порядком времени — устаревшие удаляются с начала.
+_recent_confirmations: dict[int, tuple[float, dict[int, str | bool | None], set[int]]] = {}
+
+
+def _on_join_request(user_id: int, chat_id: int) -> None:
+    recent = _recent_confirmations.get(user_id)
+    if recent is not None and chat_id not in recent[1]:
+        recent[2].add(chat_id)
+
 
-admin_states = {}
+set_join_listener(_on_join_request)
+
+
+async def _reply_already_confirmed(update: Update, handled: dict[int, str | bool | None]):
+    links = [value for value in handled.values() if isinstance(value, str)]
+    if links:
+        await update.message.reply_text(
+            "📎 Ваша ссылка для вступления в канал:\n" + "\n".join(links))
+    elif any(value is True for value in handled.values()):
+        await update.message.reply_text("✅ Возраст подтверждён, заявка на вступление уже одобрена.")
+    elif handled:
+        await update.message.reply_text("✅ Возраст уже подтверждён, доступ в канал скоро придёт.")
+    else:
+        await update.message.reply_text("✅ Возраст уже подтверждён.")
+
+
+def _prune_confirmations(now: float) -> None:
+    while _recent_confirmations:
+        user_id = next(iter(_recent_confirmations))
+        if now - _recent_confirmations[user_id][0] < CONFIRM_DEBOUNCE_SECONDS:
+            break
+        del _recent_confirmations[user_id]
 
 
 def get_main_keyboard(is_admin: bool) -> ReplyKeyboardMarkup:
@@ -29,6 +105,12 @@ def get_main_keyboard(is_admin: bool) -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(buttons, resize_keyboard=True)
 
 
+async def track_user_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Пользователь снова пишет боту — возвращаем его в рассылки."""
+    if update.effective_user:
+        await reactivate_user(update.effective_user.id)
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     is_admin = await db_is_admin(user_id)
@@ -36,19 +118,59 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     preview = await get_preview()
     if preview:
-        text, image_path = preview
-        if image_path and os.path.exists(image_path):
-            with open(image_path, 'rb') as photo:
-                await update.message.reply_photo(photo=photo, caption=text)
-        else:
-            await update.message.reply_text(text)
+        text, image_path, file_id = preview
+        await send_media(context.bot, update.effective_chat.id, text, image_path, file_id)
 
     await update.message.reply_text("👋 Пожалуйста, подтвердите, что вам уже есть 18 лет:", reply_markup=keyboard)
 
 
+# Кнопку ловит handle_text_buttons, поэтому метрика вешается здесь
+@instrument_handler
 async def confirm_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    await add_user(user_id)
+    _prune_confirmations(time.monotonic())
+
+    recent = _recent_confirmations.get(user_id)
+    if recent is not None:
+        # Свежая запись: база не читается, обрабатываются только новые заявки
+        channel_ids = [channel_id for channel_id in recent[2] if channel_id not in recent[1]]
+        recent[2].clear()
+        if not channel_ids:
+            await _reply_already_confirmed(update, recent[1])
+            return
+        requested = channel_ids
+    else:
+        # Подтверждение засчитывается в каналы, куда пользователь подал заявку;
+        # без заявки (пришёл через /start) — в канал по умолчанию
+        requested = await get_user_channels(user_id)
+        # Канал по умолчанию — только для тех, кто ещё нигде не подтверждён: иначе заявки
+        # уже обработаны, и ссылка в канал по умолчанию обошла бы его режим approve
+        already_confirmed = not requested and await is_user_confirmed_anywhere(user_id)
+
+        # Одновременное нажатие могло обогнать нас за время чтения базы
+        recent = _recent_confirmations.get(user_id)
+        if recent is not None:
+            await _reply_already_confirmed(update, recent[1])
+            return
+        recent = _recent_confirmations[user_id] = (time.monotonic(), {}, set())
+        if already_confirmed:
+            # Пустая запись: следующие нажатия тоже ответятся без базы
+            await _reply_already_confirmed(update, recent[1])
+            return
+        channel_ids = requested or [DEFAULT_CHANNEL_ID]
+    handled = recent[1]
+    handled.update(dict.fromkeys(channel_ids))
+
+    try:
+        for channel_id in channel_ids:
+            await add_user(user_id, channel_id)
+    except Exception:
+        # Подтверждение не записано — следующее нажатие должно пройти заново
+        for channel_id in channel_ids:
+            handled.pop(channel_id, None)
+        if not handled:
+            _recent_confirmations.pop(user_id, None)
+        raise
 
     is_admin = await db_is_admin(user_id)
     if is_admin:
@@ -61,23 +183,77 @@ async def confirm_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await update.message.reply_text("✅ Спасибо! Возраст подтверждён.", reply_markup=keyboard)
 
-    await asyncio.sleep(3.0)
+    # Доступ в канал и предупреждение уходят отложенными задачами JobQueue,
+    # обработчик при этом сразу освобождается для следующих апдейтов
+    context.job_queue.run_once(
+        grant_channel_access, INVITE_LINK_DELAY, chat_id=update.effective_chat.id,
+        user_id=user_id, data=[channel_id for channel_id in channel_ids if channel_id in requested])
+
+
+async def grant_channel_access(context: ContextTypes.DEFAULT_TYPE):
+    """Для каждого канала пользователя одобряет заявку (режим approve) или выдаёт ссылку.
+
+    В job.data — каналы, куда пользователь подал заявку. Без заявок выдаётся
+    ссылка в канал по умолчанию: одобрять там нечего.
+    """
+    chat_id = context.job.chat_id
+    user_id = context.job.user_id
+    requested = context.job.data or []
+
+    for channel_id in requested or [DEFAULT_CHANNEL_ID]:
+        channel = CHANNELS.get(channel_id)
+        if channel is None:
+            continue
+        if (channel.join_mode == "approve" and channel_id in requested
+                and await approve_pending_join(context.bot, user_id, channel_id)):
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text="✅ Заявка на вступление в канал одобрена."
+            )
+            recent = _recent_confirmations.get(user_id)
+            if recent is not None:
+                recent[1][channel_id] = True
+        else:
+            invite_link = await send_invite_link(context.bot, chat_id, channel_id)
+            await remove_join_requests([(user_id, channel_id)])
+            recent = _recent_confirmations.get(user_id)
+            if invite_link and recent is not None:
+                recent[1][channel_id] = invite_link
+
+    context.job_queue.run_once(
+        send_moderation_warning, MODERATION_WARNING_DELAY, chat_id=chat_id)
+
 
+async def send_invite_link(bot, chat_id: int, channel_id: int = DEFAULT_CHANNEL_ID) -> str | None:
     try:
-        invite = await context.bot.create_chat_invite_link(
-            chat_id=CHANNEL_ID,
-            member_limit=1,
-            creates_join_request=False
+        # Сначала готовая ссылка из пула, создание на лету — только если пул пуст
+        pool = invite_pools.get(channel_id)
+        invite_link = await pool.take() if pool else None
+        if invite_link is None:
+            invite = await bot.create_chat_invite_link(
+                chat_id=channel_id,
+                member_limit=1,
+                creates_join_request=False
+            )
+            invite_link = invite.invite_link
+        await bot.send_message(
+            chat_id=chat_id,
+            text=f"📎 Вот ваша ссылка для вступления в канал:\n{invite_link}"
         )
-        await update.message.reply_text(f"📎 Вот ваша ссылка для вступления в канал:\n{invite.invite_link}")
+        return invite_link
     except Exception as e:
-        print(f"Ошибка создания ссылки: {e}")
-        await update.message.reply_text("⚠️ Не удалось создать ссылку. Обратитесь к администратору.")
+        log.error("Ошибка создания ссылки",
+                  extra={"user_id": chat_id, "chat_id": channel_id, "error": str(e)})
+        await bot.send_message(
+            chat_id=chat_id,
+            text="⚠️ Не удалось создать ссылку. Обратитесь к администратору."
+        )
 
-    await asyncio.sleep(5.0)
 
-    await update.message.reply_text(
-        "⚠️ Не удаляйте бота и чат, иначе процедуру модерации придётся пройти заново."
+async def send_moderation_warning(context: ContextTypes.DEFAULT_TYPE):
+    await context.bot.send_message(
+        chat_id=context.job.chat_id,
+        text="⚠️ Не удаляйте бота и чат, иначе процедуру модерации придётся пройти заново."
     )
 
 
@@ -88,15 +264,37 @@ async def safe_reply(update, context, text, **kwargs):
         await update.callback_query.message.reply_text(text, **kwargs)
 
 
+# Варианты окна плавной доставки: (минуты, подпись); 0 — всем сразу
+DRIP_OPTIONS = (
+    (0, "⚡ Всем сразу"),
+    (30, "💧 За 30 мин"),
+    (60, "💧 За 1 ч"),
+    (120, "💧 За 2 ч"),
+)
+
+
+async def ask_drip_window(update, context):
+    """Последний шаг мастера: как быстро доставлять каждую рассылку."""
+    keyboard = [[InlineKeyboardButton(label, callback_data=f"drip_{minutes}")]
+                for minutes, label in DRIP_OPTIONS]
+    await safe_reply(
+        update, context,
+        "🚰 Как доставлять каждую рассылку?\n"
+        "Плавная доставка растягивает отправку на окно и не упирается в лимиты Telegram.",
+        reply_markup=InlineKeyboardMarkup(keyboard))
+
+
 async def generate_repeated_broadcasts(update, context, state):
-    from datetime import timedelta
-    from db import add_scheduled_broadcast
+    from datetime import datetime, timedelta
+    from db import add_recurring_campaign
     from telegram.constants import ParseMode
 
     ad_id = state.get("schedule_selected_ad")
     start_at = state.get("start_at")
+    start_at = datetime.fromisoformat(start_at) if start_at else None
     hours = state.get("repeat_every_hours")
     days = state.get("duration_days")
+    drip_minutes = state.get("drip_minutes", 0)
 
     if not (ad_id and start_at and hours and days):
         await safe_reply(update, context, "❗ Недостаточно данных для создания рассылки. Начните заново.")
@@ -107,19 +305,35 @@ async def generate_repeated_broadcasts(update, context, state):
         await safe_reply(update, context, "❗ Ошибка: реклама не найдена.")
         return
 
-    ad_text, ad_image = ad[1], ad[2]
     total = (days * 24) // hours
-    message = f"✅ Запланировано {total} рассылок ({hours} ч каждая):\n"
+    if total < 1:
+        await safe_reply(update, context, "❗ Период повтора больше длительности рассылки.")
+        return
 
-    for i in range(total):
-        send_at = start_at + timedelta(hours=i * hours)
-        await add_scheduled_broadcast(ad_text, ad_image, send_at.isoformat())
+    if drip_minutes >= hours * 60:
+        await safe_reply(update, context, "❗ Окно доставки должно быть короче периода повтора.")
+        return
 
-        local_time = send_at + timedelta(hours=3)
-        message += f"#{i+1}: {local_time.strftime('%d.%m %H:%M')}\n"
+    # Одна строка-правило; конкретные запуски планировщик создаёт сам по ходу кампании
+    end_at = start_at + timedelta(hours=(total - 1) * hours)
+    user_id = update.effective_user.id
+    campaign_id = await add_recurring_campaign(
+        ad_id, start_at.isoformat(), hours, end_at.isoformat(), drip_minutes,
+        channel_id=await get_admin_channel(user_id), created_by=user_id)
+
+    first_local = start_at + timedelta(hours=3)
+    last_local = end_at + timedelta(hours=3)
+    message = (
+        f"✅ Кампания #{campaign_id}: {total} рассылок ({hours} ч каждая)\n"
+        f"Первая: {first_local.strftime('%d.%m %H:%M')}\n"
+        f"Последняя: {last_local.strftime('%d.%m %H:%M')}"
+    )
+    if drip_minutes:
+        message += f"\n💧 Каждая доставляется плавно за {drip_minutes} мин"
+    message += html.escape(await describe_admin_channel(context.bot, user_id))
 
     await safe_reply(update, context, message.strip(), parse_mode=ParseMode.HTML)
-    admin_states.pop(update.effective_user.id, None)  # Сброс сессии
+    await admin_states.pop(update.effective_user.id)  # Сброс сессии
 
 
 async def handle_text_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -136,7 +350,11 @@ async def handle_text_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE
             await show_main_admin_panel(update, context)
             return
 
-    state = admin_states.get(user_id)
+    # Состояния бывают только у админов — обычные пользователи не трогают хранилище
+    if not await db_is_admin(user_id):
+        return
+
+    state = await admin_states.get(user_id)
 
     if isinstance(state, str):
         if state == "search_ad":
@@ -144,18 +362,15 @@ async def handle_text_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE
                 ad_id = int(text)
                 ad = await get_ad(ad_id)
                 if ad:
-                    _, ad_text, image_path = ad
-                    if image_path:
-                        with open(image_path, "rb") as photo:
-                            await update.message.reply_photo(photo=photo, caption=ad_text)
-                    else:
-                        await update.message.reply_text(ad_text)
+                    _, ad_text, image_path, file_id = ad
+                    await send_media(context.bot, update.effective_chat.id,
+                                     ad_text, image_path, file_id)
                 else:
                     await update.message.reply_text("❗ Реклама не найдена.")
             except ValueError:
                 await update.message.reply_text("⚠️ ID должен быть числом.")
             finally:
-                admin_states.pop(user_id, None)
+                await admin_states.pop(user_id)
 
         elif state == "delete_ad":
             try:
@@ -165,7 +380,7 @@ async def handle_text_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE
             except Exception as e:
                 await update.message.reply_text(f"❗ Ошибка при удалении: {e}")
             finally:
-                admin_states.pop(user_id, None)
+                await admin_states.pop(user_id)
 
         elif state == "add_admin_manual":
             try:
@@ -175,7 +390,7 @@ async def handle_text_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE
             except ValueError:
                 await update.message.reply_text("❗ ID должен быть числом.")
             finally:
-                admin_states.pop(user_id, None)
+                await admin_states.pop(user_id)
 
     elif isinstance(state, dict):
         if state.get("awaiting_custom_days"):
@@ -184,8 +399,9 @@ async def handle_text_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE
                 if days < 1:
                     raise ValueError
                 state["duration_days"] = days
-                await generate_repeated_broadcasts(update, context, state)
-                admin_states.pop(user_id, None)
+                state.pop("awaiting_custom_days", None)
+                await admin_states.set(user_id, state)
+                await ask_drip_window(update, context)
             except ValueError:
                 await update.message.reply_text("⚠️ Введите положительное целое число (например, 30)")
 
@@ -194,11 +410,10 @@ async def handle_text_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE
                 hours = int(text.strip())
                 if hours < 1:
                     raise ValueError
-                if isinstance(admin_states.get(user_id), dict):
-                    state = admin_states[user_id]
-                    state["repeat_every_hours"] = hours
-                    state["awaiting_datetime"] = True
-                    state.pop("awaiting_custom_repeat", None)
+                state["repeat_every_hours"] = hours
+                state["awaiting_datetime"] = True
+                state.pop("awaiting_custom_repeat", None)
+                await admin_states.set(user_id, state)
                 await update.message.reply_text(
                     f"✅ Период {hours} ч установлен.\nТеперь введите дату и время ПЕРВОЙ рассылки в формате:\n<YYYY-MM-DD HH:MM>"
                 )
@@ -212,8 +427,9 @@ async def handle_text_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE
                     text.strip(), "%Y-%m-%d %H:%M")
                 run_at_utc = run_at_local - timedelta(hours=3)
 
-                state["start_at"] = run_at_utc
+                state["start_at"] = run_at_utc.isoformat()
                 state["awaiting_day_count"] = True
+                await admin_states.set(user_id, state)
 
                 keyboard = [
                     [InlineKeyboardButton(
@@ -239,35 +455,62 @@ async def handle_photo_with_caption(update: Update, context: ContextTypes.DEFAUL
         await message.reply_text("ℹ️ Пришлите фото *с подписью*.")
         return
 
-    image = message.photo[-1]
-    file = await image.get_file()
-    file_id = image.file_unique_id
-    image_path = os.path.join(MEDIA_FOLDER, f"photo_{user_id}_{file_id}.jpg")
-    await file.download_to_drive(image_path)
+    state = await admin_states.get(user_id)
+    if state not in ("broadcast_new", "broadcast_media", "broadcast_test", "preview_upload"):
+        return
 
-    state = admin_states.get(user_id)
+    # Картинка не скачивается: рассылаем по file_id, локальная копия — в фоне
+    media = await ingest_photo(message.photo[-1])
 
     if state == "broadcast_new":
-        ad_id = await add_ad_get_id(message.caption, image_path)
+        ad_id = await add_ad_get_id(message.caption, media.image_path, media.file_id)
         await message.reply_text(f"✅ Реклама сохранена. ID: {ad_id}")
-        admin_states.pop(user_id, None)
+        await admin_states.pop(user_id)
+        store_in_background(context.bot, media, context.application.create_task)
 
     elif state == "broadcast_media":
-        users = await get_confirmed_users()
-        for uid in users:
-            await send_ad_to_user(context, uid, message.caption, image_path)
-            await asyncio.sleep(0.1)
-        await message.reply_text("✅ Мгновенная рассылка завершена.")
-        admin_states.pop(user_id, None)
+        await admin_states.pop(user_id)
+        # Рассылка идёт в фоне, чтобы обработчик не держал апдейт и кнопки прогресса работали.
+        # Не через application.create_task: Application.stop() ждал бы её до конца
+        control = BroadcastControl()
+        task = asyncio.create_task(run_instant_broadcast(context.bot, user_id, message, media, control))
+        _instant_broadcasts[task] = control
+        task.add_done_callback(lambda done: _instant_broadcasts.pop(done, None))
 
     elif state == "broadcast_test":
-        await send_ad_to_user(context, user_id, message.caption, image_path)
-        admin_states.pop(user_id, None)
+        await send_ad_to_user(context, user_id, message.caption, media.image_path, media.file_id)
+        await admin_states.pop(user_id)
 
     elif state == "preview_upload":
-        await set_preview(message.caption, image_path)
+        await set_preview(message.caption, media.image_path, media.file_id,
+                          channel_id=await get_admin_channel(user_id))
         await message.reply_text("✅ Превью обновлено.")
-        admin_states.pop(user_id, None)
+        await admin_states.pop(user_id)
+        store_in_background(context.bot, media, context.application.create_task)
+
+
+# Идущие мгновенные рассылки: задача -> управление (для отмены при остановке бота)
+_instant_broadcasts: dict[asyncio.Task, BroadcastControl] = {}
+
+
+async def stop_instant_broadcasts():
+    """Отменяет мгновенные рассылки и ждёт их; вызывается до остановки Application."""
+    for control in _instant_broadcasts.values():
+        control.cancel()
+    await asyncio.gather(*_instant_broadcasts, return_exceptions=True)
+
+
+async def run_instant_broadcast(bot, user_id: int, message, media, control: BroadcastControl | None = None):
+    channel_id = await get_admin_channel(user_id)
+    total = await count_confirmed_users(channel_id)
+    title = "Мгновенная рассылка" + await describe_admin_channel(bot, user_id)
+    async with BroadcastProgress(bot, user_id, title, total, control=control) as progress:
+        stats = await broadcast_ad(
+            bot, iter_confirmed_users(channel_id),
+            message.caption, media.image_path, media.file_id, control=progress.control)
+    status = "отменена" if stats.cancelled else "завершена"
+    await message.reply_text(
+        f"✅ Мгновенная рассылка {status}.\nОтправлено: {stats.sent}, ошибок: {stats.failed}")
 
 
 async def show_ad_list(query, context):
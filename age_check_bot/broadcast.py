@@ -0,0 +1,247 @@
+"""📤 broadcast.py — движок массовых рассылок с учётом лимитов Telegram.
+
+Все отправки рассылок проходят через общий экземпляр `engine`:
+1. Глобальный token bucket ограничивает число сообщений в секунду;
+2. Рассылка идёт несколькими параллельными воркерами;
+3. RetryAfter приостанавливает весь bucket на указанное время,
+   сетевые ошибки повторяются с экспоненциальной задержкой;
+4. Ошибки отдельных получателей не логируются построчно — по итогам
+   рассылки пишется одна сводка с числом ошибок по типам;
+5. Идущую рассылку можно приостановить или отменить через BroadcastControl.
+"""
+
+import asyncio
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import AsyncIterable, Awaitable, Callable, Iterable
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from config import BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_MAX_RETRIES
+from log import get_logger
+from metrics import BROADCAST_MESSAGES, BROADCAST_QUEUE_DEPTH
+
+log = get_logger("broadcast")
+
+
+class TokenBucket:
+    """Token bucket: не более `rate` захватов в секунду, всплеск до `capacity`."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Останавливает выдачу токенов (после RetryAfter от Telegram)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    self._updated = time.monotonic()
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class BroadcastStats:
+    sent: int = 0
+    failed: int = 0
+    file_id: str | None = None
+    started_at: float = field(default_factory=time.monotonic)
+    # Тип ошибки -> число получателей с этой ошибкой
+    errors: Counter = field(default_factory=Counter)
+    cancelled: bool = False
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def rate(self) -> float:
+        """Фактическая скорость, сообщений в секунду."""
+        return (self.sent + self.failed) / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self) -> dict:
+        """Поля для итоговой записи лога о рассылке."""
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "errors": dict(self.errors),
+            "elapsed": round(self.elapsed, 3),
+            "rate": round(self.rate, 1),
+            "cancelled": self.cancelled,
+        }
+
+
+class BroadcastControl:
+    """Пауза и отмена идущей рассылки; в stats — её текущая статистика."""
+
+    def __init__(self):
+        self._running = asyncio.Event()
+        self._running.set()
+        self.cancelled = False
+        self.stats: BroadcastStats | None = None
+
+    @property
+    def paused(self) -> bool:
+        return not self._running.is_set()
+
+    def pause(self) -> None:
+        if not self.cancelled:
+            self._running.clear()
+
+    def resume(self) -> None:
+        self._running.set()
+
+    def cancel(self) -> None:
+        """Оставшиеся получатели пропускаются, уже начатые отправки завершаются."""
+        self.cancelled = True
+        self._running.set()
+
+    async def wait(self) -> None:
+        """Ждёт снятия паузы."""
+        await self._running.wait()
+
+
+# Ответы BadRequest, после которых писать пользователю бесполезно
+_UNREACHABLE_ERRORS = (
+    "chat not found",
+    "user is deactivated",
+    "peer_id_invalid",
+    "bot was blocked",
+    "bot can't initiate conversation",
+)
+
+
+def is_unreachable(error: Exception) -> bool:
+    """
+    Постоянная ли ошибка доставки: пользователь заблокировал бота,
+    удалил аккаунт или чат недоступен. Остальные ошибки считаются временными.
+    """
+    if isinstance(error, Forbidden):
+        return True
+    if isinstance(error, BadRequest):
+        message = error.message.lower()
+        return any(text in message for text in _UNREACHABLE_ERRORS)
+    return False
+
+
+def _seconds(value: float | timedelta) -> float:
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class BroadcastEngine:
+    def __init__(self, rate: float, concurrency: int, max_retries: int):
+        self.bucket = TokenBucket(rate)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+
+    async def call(self, func: Callable[..., Awaitable], *args, **kwargs):
+        """
+        Вызывает метод Bot API с учётом лимита скорости.
+
+        RetryAfter и временные сетевые ошибки повторяются не более
+        max_retries раз, остальные ошибки пробрасываются сразу.
+        """
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                return await func(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                self.bucket.pause(_seconds(e.retry_after))
+            except NetworkError as e:
+                # BadRequest — тоже NetworkError в PTB, но повторять его бессмысленно
+                if isinstance(e, BadRequest) or attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(min(2 ** attempt, 30))
+            attempt += 1
+
+    async def run(
+        self,
+        recipients: Iterable[int] | AsyncIterable[int],
+        send_one: Callable[[int], Awaitable],
+        on_result: Callable[[int, bool], None] | None = None,
+        name: str = "broadcast",
+        control: BroadcastControl | None = None,
+    ) -> BroadcastStats:
+        """
+        Рассылает `send_one(user_id)` всем получателям параллельными воркерами.
+
+        Ошибка для одного получателя не останавливает рассылку и
+        учитывается в статистике как failed. Если передан `on_result`,
+        он вызывается после каждой отправки: on_result(user_id, успех).
+        По завершении в лог пишется одна сводка с меткой `name`.
+
+        Через `control` рассылку можно приостановить (воркеры ждут) или
+        отменить: новые получатели больше не берутся, а уже стоящие в
+        очереди пропускаются без отправки и без вызова on_result.
+        """
+        stats = BroadcastStats()
+        if control:
+            control.stats = stats
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def worker():
+            while (user_id := await queue.get()) is not None:
+                BROADCAST_QUEUE_DEPTH.set(queue.qsize())
+                if control:
+                    await control.wait()
+                    if control.cancelled:
+                        continue
+                try:
+                    await send_one(user_id)
+                    stats.sent += 1
+                    ok = True
+                except Exception as e:
+                    stats.failed += 1
+                    ok = False
+                    stats.errors[type(e).__name__] += 1
+                    log.debug("Ошибка доставки", extra={"broadcast": name, "user_id": user_id, "error": str(e)})
+                BROADCAST_MESSAGES.inc("sent" if ok else "failed")
+                if on_result:
+                    on_result(user_id, ok)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            if hasattr(recipients, "__aiter__"):
+                async for user_id in recipients:
+                    if control and control.cancelled:
+                        break
+                    await queue.put(user_id)
+            else:
+                for user_id in recipients:
+                    if control and control.cancelled:
+                        break
+                    await queue.put(user_id)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            stats.cancelled = bool(control and control.cancelled)
+            log.info("Рассылка завершена", extra={"broadcast": name, **stats.summary()})
+        return stats
+
+
+engine = BroadcastEngine(BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_MAX_RETRIES)
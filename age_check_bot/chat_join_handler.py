@@ -1,15 +1,40 @@
-"""📥 chat_join_handler.py — обработка join-запросов от Telegram-канала.
+"""📥 chat_join_handler.py — обработка join-запросов от Telegram-каналов.
 
 Этот модуль ловит ChatJoinRequest и отвечает пользователю:
-1. Отправляет превью (если задано);
-2. Показывает кнопку подтверждения возраста.
+1. Находит настройки канала заявки в CHANNELS (заявки в чужие чаты игнорируются);
+2. Запоминает заявку — по ней подтверждение возраста находит канал;
+3. Отправляет превью этого канала (если задано);
+4. Показывает кнопку подтверждения возраста.
+
+Здесь же — одобрение заявок после подтверждения возраста, поштучно
+и пачкой для накопившихся заявок.
 """
 
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
+from telegram import Bot, Update, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import ContextTypes
 
-from config import CHANNEL_ID
-from db import get_preview
+from broadcast import engine
+from config import CHANNELS, DELIVERY_BATCH_SIZE
+from db import (
+    get_preview,
+    add_join_request,
+    get_join_requests,
+    remove_join_requests,
+    get_confirmed_join_requests,
+)
+from log import get_logger
+from utils import send_media
+
+log = get_logger("join")
+
+# Подписчик на новые заявки: подтверждение возраста узнаёт о них без чтения базы
+_join_listener = None
+
+
+def set_join_listener(callback):
+    """callback(user_id, chat_id) вызывается после записи заявки."""
+    global _join_listener
+    _join_listener = callback
 
 
 async def handle_join_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -17,19 +42,21 @@ async def handle_join_request(update: Update, context: ContextTypes.DEFAULT_TYPE
     join_request = update.chat_join_request
     user_id = join_request.from_user.id
 
-    #Обрабатываем только нужный канал
-    if join_request.chat.id != CHANNEL_ID:
+    # Обрабатываем только наши каналы
+    channel = CHANNELS.get(join_request.chat.id)
+    if channel is None:
         return
 
-    # 🔹 Отправляем превью (если есть)
-    preview = await get_preview()
+    # 🔹 Запоминаем заявку: по ней подтверждение найдёт канал (и одобрит её в режиме approve)
+    await add_join_request(user_id, channel.chat_id)
+    if _join_listener:
+        _join_listener(user_id, channel.chat_id)
+
+    # 🔹 Отправляем превью канала (если есть)
+    preview = await get_preview(channel.chat_id)
     if preview:
-        text, image_path = preview
-        if image_path:
-            with open(image_path, 'rb') as img:
-                await context.bot.send_photo(chat_id=user_id, photo=img, caption=text)
-        else:
-            await context.bot.send_message(chat_id=user_id, text=text)
+        text, image_path, file_id = preview
+        await send_media(context.bot, user_id, text, image_path, file_id)
 
     # 🔹 Отправляем клавиатуру для подтверждения возраста
     keyboard = ReplyKeyboardMarkup(
@@ -41,3 +68,51 @@ async def handle_join_request(update: Update, context: ContextTypes.DEFAULT_TYPE
         text="Подтвердите, что вам уже есть 18 лет",
         reply_markup=keyboard
     )
+
+
+async def get_user_channels(user_id: int) -> list[int]:
+    """Каналы, в которые пользователь подал заявку (и которые обслуживает бот)."""
+    return [chat_id for chat_id in await get_join_requests(user_id) if chat_id in CHANNELS]
+
+
+async def approve_pending_join(bot: Bot, user_id: int, chat_id: int) -> bool:
+    """
+    Одобряет заявку пользователя в канал chat_id.
+
+    :return: True, если заявка одобрена
+    """
+    approved = False
+    try:
+        await bot.approve_chat_join_request(chat_id=chat_id, user_id=user_id)
+        approved = True
+    except Exception as e:
+        # Заявка могла истечь или пользователь уже в канале
+        log.warning("Не удалось одобрить заявку",
+                    extra={"user_id": user_id, "chat_id": chat_id, "error": str(e)})
+    await remove_join_requests([(user_id, chat_id)])
+    return approved
+
+
+async def approve_confirmed_backlog(bot: Bot) -> tuple[int, int]:
+    """
+    Одобряет накопившиеся заявки от пользователей, уже подтвердивших возраст.
+
+    Берутся только каналы в режиме approve. Заявки читаются пачками,
+    вызовы API идут через общий лимит движка рассылок.
+
+    :return: (одобрено, ошибок)
+    """
+    approved = failed = 0
+    chat_ids = [chat_id for chat_id, channel in CHANNELS.items() if channel.join_mode == "approve"]
+    # Обработанные заявки (в том числе неудачные) удаляются, поэтому каждая
+    # следующая пачка — просто первые записи оставшейся очереди
+    while batch := await get_confirmed_join_requests(DELIVERY_BATCH_SIZE, chat_ids):
+        async def approve(index: int):
+            user_id, chat_id = batch[index]
+            await engine.call(bot.approve_chat_join_request, chat_id=chat_id, user_id=user_id)
+
+        stats = await engine.run(range(len(batch)), approve, name="approve_backlog")
+        approved += stats.sent
+        failed += stats.failed
+        await remove_join_requests(batch)
+    return approved, failed
@@ -1,6 +1,7 @@
 """🔧 config.py — конфигурация из .env"""
 
 import os
+from dataclasses import dataclass
 from dotenv import load_dotenv
 
 # Загружаем переменные из .env файла
@@ -10,11 +11,129 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 CHANNEL_ID = int(os.getenv("CHANNEL_ID", "-1000000000000"))
 
+# Как пускать в канал после подтверждения возраста:
+# invite_link — одноразовая ссылка, approve — одобрение заявки на вступление
+JOIN_MODE = os.getenv("JOIN_MODE", "invite_link").lower()
+JOIN_MODES = ("invite_link", "approve")
+
+
+@dataclass(frozen=True)
+class ChannelConfig:
+    chat_id: int
+    join_mode: str = JOIN_MODE
+
+
+def _parse_channels(value: str) -> dict[int, ChannelConfig]:
+    channels = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        chat_id, _, join_mode = item.partition(":")
+        channels[int(chat_id)] = ChannelConfig(int(chat_id), (join_mode or JOIN_MODE).lower())
+    return channels
+
+
+# Несколько каналов в одном процессе: "chat_id[:режим],chat_id[:режим]",
+# например "-1001:approve,-1002". Без CHANNELS — один канал CHANNEL_ID.
+# Словарь по chat_id: заявка находит настройки своего канала за O(1).
+# Первый канал — канал по умолчанию (/start без заявки, старые данные)
+CHANNELS = _parse_channels(os.getenv("CHANNELS", "")) or {CHANNEL_ID: ChannelConfig(CHANNEL_ID)}
+DEFAULT_CHANNEL_ID = next(iter(CHANNELS))
+
+# Пул готовых ссылок-приглашений: нижний/верхний уровень (0 — пул выключен),
+# срок жизни ссылки в часах и пауза между созданием ссылок в секундах
+INVITE_POOL_LOW = int(os.getenv("INVITE_POOL_LOW", "10"))
+INVITE_POOL_HIGH = int(os.getenv("INVITE_POOL_HIGH", "50"))
+INVITE_LINK_TTL_HOURS = int(os.getenv("INVITE_LINK_TTL_HOURS", "72"))
+INVITE_POOL_REFILL_INTERVAL = float(os.getenv("INVITE_POOL_REFILL_INTERVAL", "1"))
+# Повторные нажатия «Мне есть 18» в течение этого времени (сек) не подтверждают
+# возраст заново — пользователю повторяется уже выданная ссылка
+CONFIRM_DEBOUNCE_SECONDS = float(os.getenv("CONFIRM_DEBOUNCE_SECONDS", "300"))
+
+# Адрес Bot API (по умолчанию api.telegram.org) — для локального Bot API
+# сервера или фейкового сервера нагрузочных тестов, например http://127.0.0.1:8081
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL", "")
+
+# Режим получения апдейтов: polling (по умолчанию) или webhook
+RUN_MODE = os.getenv("RUN_MODE", "polling").lower()
+
+# Webhook: адрес и порт локального сервера, путь, публичный URL (без пути),
+# секрет для заголовка X-Telegram-Bot-Api-Secret-Token и лимит соединений
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Сколько апдейтов обрабатывается параллельно
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))
+
+# Рассылки: сообщений в секунду, параллельных отправок, повторов при ошибках
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+# Сколько получателей забирается из очереди доставки за раз
+DELIVERY_BATCH_SIZE = int(os.getenv("DELIVERY_BATCH_SIZE", "200"))
+# Плавная доставка: длина одной волны в секундах (окно делится на волны)
+DRIP_WAVE_SECONDS = int(os.getenv("DRIP_WAVE_SECONDS", "60"))
+# Как часто обновляется сообщение с прогрессом рассылки (сек)
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "10"))
+# Сколько раз за рассылку обновляются цифры прогресса (каждые 100/N процентов),
+# сколько бы она ни длилась; паузы и отмена показываются сразу
+PROGRESS_MAX_EDITS = int(os.getenv("PROGRESS_MAX_EDITS", "50"))
+
+# Состояния диалогов админов: memory или sqlite (общее для нескольких воркеров),
+# время жизни брошенной сессии в секундах и лимит записей в памяти
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+STATE_TTL = float(os.getenv("STATE_TTL", "3600"))
+STATE_MAX_SIZE = int(os.getenv("STATE_MAX_SIZE", "1000"))
+
+# Метрики Prometheus: порт эндпоинта /metrics (0 — выключено)
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Кэш имён пользователей в админских меню: TTL (сек) и число
+# одновременных запросов getChat
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "3600"))
+PROFILE_FETCH_CONCURRENCY = int(os.getenv("PROFILE_FETCH_CONCURRENCY", "8"))
+
+# Логирование: уровень (DEBUG, INFO, WARNING, …) и формат (json или text)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+
 # Пути по умолчанию
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MEDIA_FOLDER = os.path.join(BASE_DIR, "../data")
-DB_PATH = os.path.join(MEDIA_FOLDER, "data.sqlite")
+DB_PATH = os.getenv("DB_PATH", os.path.join(MEDIA_FOLDER, "data.sqlite"))
+
+# Хранить ли локальную копию картинок рекламы и превью (1 — да). Без копии
+# картинка отправляется только по file_id Telegram; копия нужна, чтобы
+# пережить смену токена бота
+MEDIA_LOCAL_COPY = os.getenv("MEDIA_LOCAL_COPY", "0") == "1"
+
+# База данных
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+# Размер куска при потоковом чтении получателей рассылки
+RECIPIENT_CHUNK_SIZE = int(os.getenv("RECIPIENT_CHUNK_SIZE", "1000"))
+
+# Отложенная запись подтверждений: интервал в секундах (0 — писать сразу)
+# и размер буфера, при котором запись начинается досрочно
+USER_FLUSH_INTERVAL = float(os.getenv("USER_FLUSH_INTERVAL", "0.5"))
+USER_FLUSH_BATCH = int(os.getenv("USER_FLUSH_BATCH", "200"))
+
+# Кэш админов: период перечитывания из базы в секундах (0 — только при старте)
+ADMIN_CACHE_TTL = float(os.getenv("ADMIN_CACHE_TTL", "0"))
 
 # Проверка токена (опционально)
 if not BOT_TOKEN:
     raise RuntimeError("❌ BOT_TOKEN не задан в .env")
+
+# Опечатка в режиме дала бы канал без одобрения заявок и без пула ссылок
+for _channel in CHANNELS.values():
+    if _channel.join_mode not in JOIN_MODES:
+        raise RuntimeError(f"❌ Неизвестный режим вступления {_channel.join_mode!r} у канала "
+                           f"{_channel.chat_id} (JOIN_MODE/CHANNELS): допустимо {', '.join(JOIN_MODES)}")
+
+# Без публичного адреса Telegram некуда слать апдейты: PTB подставил бы
+# адрес прослушивания (0.0.0.0), и setWebhook упал бы при старте
+if RUN_MODE == "webhook" and not WEBHOOK_URL:
+    raise RuntimeError("❌ RUN_MODE=webhook, но WEBHOOK_URL не задан в .env (например, https://bot.example.com)")
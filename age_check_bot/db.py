@@ -1,16 +1,170 @@
-import os
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
 import aiosqlite
-from config import DB_PATH
+from log import get_logger
+from metrics import timed_query
+from config import (
+    DB_PATH,
+    DB_READ_POOL_SIZE,
+    DEFAULT_CHANNEL_ID,
+    ADMIN_CACHE_TTL,
+    RECIPIENT_CHUNK_SIZE,
+    USER_FLUSH_INTERVAL,
+    USER_FLUSH_BATCH,
+)
+
+log = get_logger("db")
+
+# --- Пул соединений ---
+# Одно соединение на запись (SQLite всё равно сериализует писателей) и
+# небольшой пул соединений на чтение. В режиме WAL читатели не блокируют
+# писателя и друг друга.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+)
+
+_writer: aiosqlite.Connection | None = None
+_write_lock = asyncio.Lock()
+_readers: asyncio.Queue | None = None
+_reader_conns: list[aiosqlite.Connection] = []
+_open_lock = asyncio.Lock()
+# После close_db соединения не открываются заново неявно: запись из фоновой
+# задачи, пережившей остановку, открыла бы новые потоки aiosqlite и не дала
+# процессу завершиться
+_closed = False
+
+
+async def _connect() -> aiosqlite.Connection:
+    conn = await aiosqlite.connect(DB_PATH)
+    for pragma in PRAGMAS:
+        await conn.execute(pragma)
+    return conn
+
+
+async def open_db(read_pool_size: int = DB_READ_POOL_SIZE):
+    """Открывает долгоживущие соединения. Повторный вызов ничего не делает."""
+    global _writer, _readers, _closed
+    async with _open_lock:
+        _closed = False
+        if _writer is not None:
+            return
+        writer = await _connect()
+        readers = asyncio.Queue()
+        for _ in range(max(1, read_pool_size)):
+            conn = await _connect()
+            _reader_conns.append(conn)
+            readers.put_nowait(conn)
+        _writer, _readers = writer, readers
+        _start_user_flusher()
+
+
+async def close_db():
+    """Дописывает буфер подтверждений и закрывает все соединения пула."""
+    global _writer, _readers, _closed
+    await _stop_user_flusher()
+    async with _open_lock:
+        _closed = True
+        if _writer is None:
+            return
+        async with _write_lock:
+            await _writer.close()
+        for conn in _reader_conns:
+            await conn.close()
+        _reader_conns.clear()
+        _writer, _readers = None, None
+
+
+async def _reopen():
+    """Ленивое открытие пула при первом запросе — но не после close_db."""
+    if _closed:
+        raise RuntimeError("База данных закрыта (close_db)")
+    await open_db()
+
+
+@asynccontextmanager
+async def _write():
+    """Соединение на запись: коммит при успехе, откат при ошибке."""
+    if _writer is None:
+        await _reopen()
+    async with _write_lock:
+        try:
+            yield _writer
+            await _writer.commit()
+        except BaseException:
+            await _writer.rollback()
+            raise
+
+
+@asynccontextmanager
+async def _read():
+    """Соединение на чтение из пула."""
+    if _readers is None:
+        await _reopen()
+    readers = _readers
+    conn = await readers.get()
+    try:
+        yield conn
+    finally:
+        readers.put_nowait(conn)
+
+
+async def _add_column_if_missing(db, table: str, column: str, decl: str):
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        columns = {row[1] for row in await cursor.fetchall()}
+    if column not in columns:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+async def _scope_table_by_channel(db, table: str, create_sql: str, columns: str):
+    """
+    Пересоздаёт таблицу старой схемы (без channel_id) с новым ключом:
+    SQLite не умеет менять PRIMARY KEY через ALTER TABLE. Старые строки
+    переносятся в канал по умолчанию.
+    """
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        if "channel_id" in {row[1] for row in await cursor.fetchall()}:
+            return
+    await db.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+    await db.execute(create_sql)
+    await db.execute(
+        f"INSERT INTO {table} (channel_id, {columns}) SELECT ?, {columns} FROM {table}_old",
+        (DEFAULT_CHANNEL_ID,)
+    )
+    await db.execute(f"DROP TABLE {table}_old")
+
+
+# Подтверждения и превью — свои у каждого канала
+_CONFIRMED_USERS_SQL = """
+    CREATE TABLE IF NOT EXISTS confirmed_users (
+        channel_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        confirmed_at TEXT,
+        status TEXT NOT NULL DEFAULT 'active',
+        unreachable_at TEXT,
+        PRIMARY KEY (channel_id, user_id)
+    );
+"""
+
+_PREVIEW_SQL = """
+    CREATE TABLE IF NOT EXISTS preview (
+        channel_id INTEGER PRIMARY KEY,
+        text TEXT,
+        image_path TEXT,
+        file_id TEXT
+    );
+"""
 
 
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS confirmed_users (
-                user_id INTEGER PRIMARY KEY,
-                confirmed_at TEXT
-            );
-        """)
+    async with _write() as db:
+        await db.execute(_CONFIRMED_USERS_SQL)
 
         await db.execute("""
             CREATE TABLE IF NOT EXISTS ads (
@@ -26,156 +180,940 @@ async def init_db():
             );
         """)
 
+        await db.execute(_PREVIEW_SQL)
+
         await db.execute("""
-            CREATE TABLE IF NOT EXISTS preview (
-                id INTEGER PRIMARY KEY CHECK (id = 1),
+            CREATE TABLE IF NOT EXISTS scheduled_broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
                 text TEXT,
-                image_path TEXT
+                image_path TEXT,
+                send_at TEXT
             );
         """)
 
+        # Доставки рассылок: по строке на (рассылка, получатель).
+        # status: pending → sending → sent / failed
         await db.execute("""
-            CREATE TABLE IF NOT EXISTS scheduled_broadcasts (
+            CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                broadcast_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                updated_at TEXT,
+                PRIMARY KEY (broadcast_id, user_id)
+            );
+        """)
+
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_scheduled_broadcasts_send_at
+            ON scheduled_broadcasts (send_at);
+        """)
+
+        # Повторяющиеся кампании: правило вместо заранее созданных строк.
+        # next_at — время ближайшего запуска, end_at — последнего (включительно)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS recurring_campaigns (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                text TEXT,
+                ad_id INTEGER NOT NULL,
+                start_at TEXT NOT NULL,
+                period_hours INTEGER NOT NULL,
+                end_at TEXT NOT NULL,
+                next_at TEXT NOT NULL
+            );
+        """)
+
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_recurring_campaigns_next_at
+            ON recurring_campaigns (next_at);
+        """)
+
+        # Состояния админов (бэкенд STATE_BACKEND=sqlite): диалоги и выбранный канал
+        for table in STATE_TABLES:
+            await db.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    user_id INTEGER PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+            """)
+
+            await db.execute(f"""
+                CREATE INDEX IF NOT EXISTS idx_{table}_updated_at
+                ON {table} (updated_at);
+            """)
+
+        # Заявки на вступление, ждущие подтверждения возраста: по ним подтверждение
+        # находит канал пользователя, а в режиме approve заявка одобряется
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS join_requests (
+                user_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                requested_at TEXT,
+                PRIMARY KEY (user_id, chat_id)
+            );
+        """)
+
+        # Пул заранее созданных одноразовых ссылок-приглашений
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS invite_links (
+                invite_link TEXT PRIMARY KEY,
+                chat_id INTEGER NOT NULL,
+                created_at TEXT,
+                expires_at TEXT NOT NULL
+            );
+        """)
+
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_invite_links_chat_expires
+            ON invite_links (chat_id, expires_at);
+        """)
+
+        # Локальные копии медиа: одна запись на картинку Telegram (file_unique_id),
+        # sha256 — для поиска одинаковых файлов, загруженных заново
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS media (
+                file_unique_id TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
                 image_path TEXT,
-                send_at TEXT
+                sha256 TEXT,
+                created_at TEXT
             );
         """)
 
-        await db.commit()
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_media_sha256 ON media (sha256);
+        """)
+
+        # --- Миграции ---
+        # file_id, который вернул Telegram после первой загрузки картинки
+        for table in ("ads", "preview", "scheduled_broadcasts"):
+            await _add_column_if_missing(db, table, "file_id", "TEXT")
+        # Время, когда рассылка начала доставку (NULL — ещё не начиналась)
+        await _add_column_if_missing(db, "scheduled_broadcasts", "started_at", "TEXT")
+        # Недоступные получатели (заблокировали бота / удалили аккаунт)
+        await _add_column_if_missing(
+            db, "confirmed_users", "status", "TEXT NOT NULL DEFAULT 'active'")
+        await _add_column_if_missing(db, "confirmed_users", "unreachable_at", "TEXT")
+        # Плавная доставка: окно в минутах (0 — сразу всем) и волна получателя
+        for table in ("recurring_campaigns", "scheduled_broadcasts"):
+            await _add_column_if_missing(db, table, "drip_minutes", "INTEGER NOT NULL DEFAULT 0")
+        await _add_column_if_missing(db, "broadcast_deliveries", "wave", "INTEGER NOT NULL DEFAULT 0")
+        await db.execute("DROP INDEX IF EXISTS idx_broadcast_deliveries_status")
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_broadcast_deliveries_wave
+            ON broadcast_deliveries (broadcast_id, status, wave, user_id);
+        """)
+        # Несколько каналов: подтверждения, превью и рассылки привязаны к каналу
+        await _scope_table_by_channel(
+            db, "confirmed_users", _CONFIRMED_USERS_SQL, "user_id, confirmed_at, status, unreachable_at")
+        await _scope_table_by_channel(db, "preview", _PREVIEW_SQL, "text, image_path, file_id")
+        for table in ("scheduled_broadcasts", "recurring_campaigns"):
+            await _add_column_if_missing(
+                db, table, "channel_id", f"INTEGER NOT NULL DEFAULT {DEFAULT_CHANNEL_ID}")
+        # Кто создал кампанию — ему приходит прогресс доставки
+        for table in ("scheduled_broadcasts", "recurring_campaigns"):
+            await _add_column_if_missing(db, table, "created_by", "INTEGER")
+        # Статус недоступности общий для всех каналов пользователя
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_confirmed_users_user_id
+            ON confirmed_users (user_id);
+        """)
 
 
 # --- Подтверждённые пользователи ---
-async def add_user(user_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR IGNORE INTO confirmed_users (user_id, confirmed_at) VALUES (?, datetime('now'))",
-            (user_id,)
+# Подтверждения пишутся отложенно (write-behind): add_user кладёт пользователя
+# в буфер, а фоновая задача записывает буфер одной транзакцией раз в
+# USER_FLUSH_INTERVAL секунд или как только набралось USER_FLUSH_BATCH записей.
+#
+# Гарантии: при штатной остановке (close_db — Ctrl+C или SIGTERM, в том числе
+# docker stop) буфер дописывается полностью.
+# При аварийном завершении процесса теряются подтверждения не более чем за
+# последний интервал — пользователю придётся нажать кнопку ещё раз.
+# is_user_confirmed видит буфер сразу, а выборки получателей рассылок
+# и заявок сначала сбрасывают его в базу. USER_FLUSH_INTERVAL=0 — запись сразу.
+_pending_users: dict[tuple[int, int], str] = {}
+_flush_now = asyncio.Event()
+_flush_task: asyncio.Task | None = None
+
+
+def _start_user_flusher():
+    global _flush_task
+    if USER_FLUSH_INTERVAL > 0 and _flush_task is None:
+        _flush_task = asyncio.create_task(_user_flush_loop())
+
+
+async def _stop_user_flusher():
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        _flush_task = None
+    if _writer is not None:
+        await flush_users()
+
+
+async def _user_flush_loop():
+    while True:
+        try:
+            await asyncio.wait_for(_flush_now.wait(), USER_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _flush_now.clear()
+        try:
+            await flush_users()
+        except Exception as e:
+            log.error("Ошибка записи подтверждений", extra={"pending": len(_pending_users), "error": str(e)})
+
+
+@timed_query
+async def flush_users():
+    """Записывает буфер подтверждений одной транзакцией."""
+    if not _pending_users:
+        return
+    batch = list(_pending_users.items())
+    async with _write() as db:
+        await db.executemany(
+            "INSERT OR IGNORE INTO confirmed_users (channel_id, user_id, confirmed_at) VALUES (?, ?, ?)",
+            [(channel_id, user_id, confirmed_at) for (channel_id, user_id), confirmed_at in batch]
         )
-        await db.commit()
+    # Удаляем из буфера только после коммита, чтобы is_user_confirmed не мигал
+    for key, confirmed_at in batch:
+        if _pending_users.get(key) == confirmed_at:
+            del _pending_users[key]
 
 
-async def is_user_confirmed(user_id: int) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT 1 FROM confirmed_users WHERE user_id = ?", (user_id,)) as cursor:
+async def add_user(user_id: int, channel_id: int = DEFAULT_CHANNEL_ID):
+    _pending_users.setdefault(
+        (channel_id, user_id), datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"))
+    if USER_FLUSH_INTERVAL <= 0 or _flush_task is None:
+        await flush_users()
+    elif len(_pending_users) >= USER_FLUSH_BATCH:
+        _flush_now.set()
+
+
+@timed_query
+async def is_user_confirmed(user_id: int, channel_id: int = DEFAULT_CHANNEL_ID) -> bool:
+    if (channel_id, user_id) in _pending_users:
+        return True
+    async with _read() as db:
+        async with db.execute(
+            "SELECT 1 FROM confirmed_users WHERE channel_id = ? AND user_id = ?", (channel_id, user_id)
+        ) as cursor:
             return await cursor.fetchone() is not None
 
 
-async def get_confirmed_users() -> list[int]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT user_id FROM confirmed_users") as cursor:
-            return [row[0] for row in await cursor.fetchall()]
+@timed_query
+async def is_user_confirmed_anywhere(user_id: int) -> bool:
+    """Подтвердил ли пользователь возраст хотя бы в одном канале."""
+    if any(uid == user_id for _, uid in _pending_users):
+        return True
+    async with _read() as db:
+        async with db.execute("SELECT 1 FROM confirmed_users WHERE user_id = ? LIMIT 1", (user_id,)) as cursor:
+            return await cursor.fetchone() is not None
+
+
+async def iter_confirmed_users(channel_id: int = DEFAULT_CHANNEL_ID,
+                               chunk_size: int = RECIPIENT_CHUNK_SIZE):
+    """
+    Асинхронно перебирает подтверждённых пользователей канала по возрастанию user_id.
+
+    Читает базу кусками по chunk_size (keyset-пагинация по первичному ключу),
+    поэтому память не растёт с числом пользователей. Соединение берётся из
+    пула только на время чтения куска, а не на всю рассылку.
+    """
+    await flush_users()
+    last_id = -(2 ** 63)
+    while True:
+        async with _read() as db:
+            async with db.execute(
+                "SELECT user_id FROM confirmed_users "
+                "WHERE channel_id = ? AND user_id > ? AND status = 'active' "
+                "ORDER BY user_id LIMIT ?",
+                (channel_id, last_id, chunk_size)
+            ) as cursor:
+                rows = await cursor.fetchall()
+
+        for (user_id,) in rows:
+            yield user_id
+
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
+
+
+@timed_query
+async def count_confirmed_users(channel_id: int = DEFAULT_CHANNEL_ID) -> int:
+    await flush_users()
+    async with _read() as db:
+        async with db.execute(
+            "SELECT COUNT(*) FROM confirmed_users WHERE channel_id = ? AND status = 'active'", (channel_id,)
+        ) as cursor:
+            return (await cursor.fetchone())[0]
+
+
+# Пользователи, до которых сообщения не доходят, исключаются из рассылок
+# и снова становятся активными, когда пишут боту. Их id держатся в памяти,
+# чтобы проверка на каждом сообщении не ходила в базу.
+_unreachable_ids: set[int] = set()
+
+
+@timed_query
+async def load_unreachable_users():
+    async with _read() as db:
+        async with db.execute(
+            "SELECT DISTINCT user_id FROM confirmed_users WHERE status = 'unreachable'"
+        ) as cursor:
+            _unreachable_ids.update(row[0] for row in await cursor.fetchall())
+
+
+@timed_query
+async def mark_users_unreachable(user_ids: list[int]):
+    if not user_ids:
+        return
+    async with _write() as db:
+        await db.executemany(
+            "UPDATE confirmed_users SET status = 'unreachable', unreachable_at = datetime('now') "
+            "WHERE user_id = ?",
+            [(uid,) for uid in user_ids]
+        )
+    _unreachable_ids.update(user_ids)
+
+
+async def reactivate_user(user_id: int):
+    if user_id not in _unreachable_ids:
+        return
+    async with _write() as db:
+        await db.execute(
+            "UPDATE confirmed_users SET status = 'active', unreachable_at = NULL WHERE user_id = ?",
+            (user_id,)
+        )
+    _unreachable_ids.discard(user_id)
 
 
 # --- Реклама ---
-async def add_ad(text: str, image_path: str | None = None):
-    async with aiosqlite.connect(DB_PATH) as db:
+@timed_query
+async def add_ad(text: str, image_path: str | None = None, file_id: str | None = None):
+    async with _write() as db:
         await db.execute(
-            "INSERT INTO ads (text, image_path) VALUES (?, ?)",
-            (text, image_path)
+            "INSERT INTO ads (text, image_path, file_id) VALUES (?, ?, ?)",
+            (text, image_path, file_id)
         )
-        await db.commit()
 
 
+@timed_query
 async def get_ad(ad_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT id, text, image_path FROM ads WHERE id = ?", (ad_id,)) as cursor:
+    async with _read() as db:
+        async with db.execute("SELECT id, text, image_path, file_id FROM ads WHERE id = ?", (ad_id,)) as cursor:
             return await cursor.fetchone()
 
 
+@timed_query
 async def get_all_ads():
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _read() as db:
         async with db.execute("SELECT id, text FROM ads ORDER BY id") as cursor:
             return await cursor.fetchall()
 
 
+@timed_query
 async def get_latest_ad():
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT id, text, image_path FROM ads ORDER BY id DESC LIMIT 1") as cursor:
+    async with _read() as db:
+        async with db.execute("SELECT id, text, image_path, file_id FROM ads ORDER BY id DESC LIMIT 1") as cursor:
             return await cursor.fetchone()
 
 
-async def add_ad_get_id(text: str, image_path: str | None = None) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
+@timed_query
+async def add_ad_get_id(text: str, image_path: str | None = None, file_id: str | None = None) -> int:
+    async with _write() as db:
         cursor = await db.execute(
-            "INSERT INTO ads (text, image_path) VALUES (?, ?)",
-            (text, image_path)
+            "INSERT INTO ads (text, image_path, file_id) VALUES (?, ?, ?)",
+            (text, image_path, file_id)
         )
-        await db.commit()
         return cursor.lastrowid
 
 
+@timed_query
 async def remove_ad(ad_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write() as db:
         await db.execute("DELETE FROM ads WHERE id = ?", (ad_id,))
-        await db.commit()
 
 
 # --- Админы ---
+# Множество админов держится в памяти: загружается один раз при старте,
+# add_admin/remove_admin обновляют его сразу после записи в базу.
+# При ADMIN_CACHE_TTL > 0 множество периодически перечитывается из базы
+# (на случай правок базы в обход бота).
+_admin_ids: set[int] | None = None
+_admin_loaded_at = 0.0
+
+
+@timed_query
+async def load_admins() -> set[int]:
+    global _admin_ids, _admin_loaded_at
+    async with _read() as db:
+        async with db.execute("SELECT user_id FROM admins") as cursor:
+            _admin_ids = {row[0] for row in await cursor.fetchall()}
+    _admin_loaded_at = time.monotonic()
+    return _admin_ids
+
+
 async def is_admin(user_id: int) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT 1 FROM admins WHERE user_id = ?", (user_id,)) as cursor:
-            return await cursor.fetchone() is not None
+    admin_ids = _admin_ids
+    if admin_ids is None or (
+            ADMIN_CACHE_TTL > 0 and time.monotonic() - _admin_loaded_at > ADMIN_CACHE_TTL):
+        admin_ids = await load_admins()
+    return user_id in admin_ids
 
 
+@timed_query
 async def add_admin(user_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write() as db:
         await db.execute("INSERT OR IGNORE INTO admins (user_id) VALUES (?)", (user_id,))
-        await db.commit()
+    if _admin_ids is not None:
+        _admin_ids.add(user_id)
 
 
+@timed_query
 async def remove_admin(user_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write() as db:
         await db.execute("DELETE FROM admins WHERE user_id = ?", (user_id,))
-        await db.commit()
+    if _admin_ids is not None:
+        _admin_ids.discard(user_id)
 
 
+@timed_query
 async def get_admins() -> list[int]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _read() as db:
         async with db.execute("SELECT user_id FROM admins") as cursor:
             return [row[0] for row in await cursor.fetchall()]
 
 
 # --- Превью ---
-async def get_preview():
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT text, image_path FROM preview WHERE id = 1") as cursor:
+@timed_query
+async def get_preview(channel_id: int = DEFAULT_CHANNEL_ID):
+    async with _read() as db:
+        async with db.execute(
+            "SELECT text, image_path, file_id FROM preview WHERE channel_id = ?", (channel_id,)
+        ) as cursor:
             return await cursor.fetchone()
 
 
-async def set_preview(text: str, image_path: str | None = None):
-    async with aiosqlite.connect(DB_PATH) as db:
+@timed_query
+async def set_preview(text: str, image_path: str | None = None, file_id: str | None = None,
+                      channel_id: int = DEFAULT_CHANNEL_ID):
+    async with _write() as db:
         await db.execute(
-            "REPLACE INTO preview (id, text, image_path) VALUES (1, ?, ?)",
-            (text, image_path)
+            "REPLACE INTO preview (channel_id, text, image_path, file_id) VALUES (?, ?, ?, ?)",
+            (channel_id, text, image_path, file_id)
         )
-        await db.commit()
 
 
 # --- Отложенные рассылки ---
-async def add_scheduled_broadcast(text: str, image_path: str | None, send_at: str):
-    async with aiosqlite.connect(DB_PATH) as db:
+# send_at хранится как datetime.isoformat() в UTC, поэтому строки сравниваются
+# в том же порядке, что и время. Планировщик подписывается через
+# set_schedule_listener и просыпается сразу после добавления рассылки.
+_schedule_listener = None
+
+
+def set_schedule_listener(callback):
+    """callback(send_at: str) вызывается после добавления рассылки."""
+    global _schedule_listener
+    _schedule_listener = callback
+
+
+@timed_query
+async def add_scheduled_broadcast(text: str, image_path: str | None, send_at: str,
+                                  file_id: str | None = None, channel_id: int = DEFAULT_CHANNEL_ID,
+                                  created_by: int | None = None):
+    async with _write() as db:
         await db.execute(
-            "INSERT INTO scheduled_broadcasts (text, image_path, send_at) VALUES (?, ?, ?)",
-            (text, image_path, send_at)
+            "INSERT INTO scheduled_broadcasts (text, image_path, send_at, file_id, channel_id, created_by) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (text, image_path, send_at, file_id, channel_id, created_by)
         )
-        await db.commit()
+    if _schedule_listener:
+        _schedule_listener(send_at)
+
+
+@timed_query
+async def get_due_broadcasts(now: str):
+    async with _read() as db:
+        async with db.execute(
+            "SELECT id, text, image_path, send_at, file_id, drip_minutes, created_by FROM scheduled_broadcasts "
+            "WHERE send_at <= ? ORDER BY send_at",
+            (now,)
+        ) as cursor:
+            return await cursor.fetchall()
+
+
+@timed_query
+async def get_next_send_at() -> str | None:
+    """Ближайшее время запуска среди рассылок, которые ещё не начали доставку."""
+    async with _read() as db:
+        async with db.execute("""
+            SELECT MIN(t) FROM (
+                SELECT MIN(send_at) AS t FROM scheduled_broadcasts WHERE started_at IS NULL
+                UNION ALL
+                SELECT MIN(next_at) FROM recurring_campaigns
+            )
+        """) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else None
 
 
-async def get_scheduled_broadcasts():
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("SELECT id, text, image_path, send_at FROM scheduled_broadcasts ORDER BY send_at") as cursor:
+@timed_query
+async def get_pending_broadcasts(limit: int, preview_len: int = 30) -> list:
+    """
+    Ближайшие разовые рассылки, доставка которых ещё не началась, — для админского
+    списка (в том числе строки, созданные до перехода на кампании).
+
+    :return: строки (id, channel_id, send_at, drip_minutes, short_text)
+    """
+    async with _read() as db:
+        async with db.execute(
+            "SELECT id, channel_id, send_at, drip_minutes, "
+            "trim(replace(substr(text, 1, ?), char(10), ' ')) "
+            "FROM scheduled_broadcasts WHERE started_at IS NULL ORDER BY send_at, id LIMIT ?",
+            (preview_len, limit)
+        ) as cursor:
             return await cursor.fetchall()
 
 
+@timed_query
+async def count_pending_broadcasts() -> int:
+    async with _read() as db:
+        async with db.execute(
+            "SELECT COUNT(*) FROM scheduled_broadcasts WHERE started_at IS NULL"
+        ) as cursor:
+            return (await cursor.fetchone())[0]
+
+
+@timed_query
 async def remove_scheduled_broadcast(broadcast_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write() as db:
         await db.execute("DELETE FROM scheduled_broadcasts WHERE id = ?", (broadcast_id,))
-        await db.commit()
+        await db.execute("DELETE FROM broadcast_deliveries WHERE broadcast_id = ?", (broadcast_id,))
 
 
+@timed_query
 async def remove_all_scheduled_broadcasts():
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _write() as db:
+        await db.execute("DELETE FROM recurring_campaigns")
         await db.execute("DELETE FROM scheduled_broadcasts")
-        await db.commit()
+        await db.execute("DELETE FROM broadcast_deliveries")
+
+
+# --- Повторяющиеся кампании ---
+@timed_query
+async def add_recurring_campaign(ad_id: int, start_at: str, period_hours: int, end_at: str,
+                                 drip_minutes: int = 0, channel_id: int = DEFAULT_CHANNEL_ID,
+                                 created_by: int | None = None) -> int:
+    async with _write() as db:
+        cursor = await db.execute(
+            "INSERT INTO recurring_campaigns "
+            "(ad_id, start_at, period_hours, end_at, next_at, drip_minutes, channel_id, created_by) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (ad_id, start_at, period_hours, end_at, start_at, drip_minutes, channel_id, created_by)
+        )
+        campaign_id = cursor.lastrowid
+    if _schedule_listener:
+        _schedule_listener(start_at)
+    return campaign_id
+
+
+@timed_query
+async def get_recurring_campaigns_page(
+    limit: int,
+    after: tuple[str, int] | None = None,
+    before: tuple[str, int] | None = None,
+    preview_len: int = 30
+) -> tuple[list, bool]:
+    """
+    Страница кампаний в порядке (next_at, id) для админского списка.
+
+    Keyset-пагинация по индексу next_at: `after` — ключ последней строки
+    предыдущей страницы, `before` — ключ первой строки следующей. Текст
+    рекламы обрезается в SQL до preview_len символов.
+
+    :return: (строки (id, channel_id, period_hours, next_at, end_at, drip_minutes, short_text),
+              есть ли ещё строки в направлении листания)
+    """
+    if before is not None:
+        where, order, params = "WHERE (c.next_at, c.id) < (?, ?)", "DESC", before
+    elif after is not None:
+        where, order, params = "WHERE (c.next_at, c.id) > (?, ?)", "ASC", after
+    else:
+        where, order, params = "", "ASC", ()
+    async with _read() as db:
+        async with db.execute(
+            "SELECT c.id, c.channel_id, c.period_hours, c.next_at, c.end_at, c.drip_minutes, "
+            "trim(replace(substr(a.text, 1, ?), char(10), ' ')) "
+            f"FROM recurring_campaigns c LEFT JOIN ads a ON a.id = c.ad_id {where} "
+            f"ORDER BY c.next_at {order}, c.id {order} LIMIT ?",
+            (preview_len, *params, limit + 1)
+        ) as cursor:
+            rows = await cursor.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before is not None:
+        rows.reverse()
+    return rows, has_more
+
+
+@timed_query
+async def count_recurring_campaigns() -> int:
+    async with _read() as db:
+        async with db.execute("SELECT COUNT(*) FROM recurring_campaigns") as cursor:
+            return (await cursor.fetchone())[0]
+
+
+@timed_query
+async def remove_recurring_campaign(campaign_id: int):
+    async with _write() as db:
+        await db.execute("DELETE FROM recurring_campaigns WHERE id = ?", (campaign_id,))
+
+
+@timed_query
+async def materialize_due_campaigns(now: str) -> int:
+    """
+    Создаёт рассылку для каждой кампании, у которой наступил next_at,
+    и переносит next_at на следующий запуск после `now`. Пропущенные
+    за время простоя запуски не догоняются. Кампания удаляется после
+    последнего запуска или если её реклама удалена.
+
+    :return: Сколько рассылок создано
+    """
+    now_dt = datetime.fromisoformat(now)
+    created = 0
+    async with _write() as db:
+        async with db.execute(
+            "SELECT c.id, c.channel_id, c.period_hours, c.end_at, c.next_at, c.drip_minutes, "
+            "c.created_by, a.id, a.text, a.image_path, a.file_id "
+            "FROM recurring_campaigns c LEFT JOIN ads a ON a.id = c.ad_id "
+            "WHERE c.next_at <= ?",
+            (now,)
+        ) as cursor:
+            due = await cursor.fetchall()
+
+        for c_id, channel_id, period_hours, end_at, next_at, drip_minutes, created_by, \
+                ad_id, text, image_path, file_id in due:
+            if ad_id is None:
+                await db.execute("DELETE FROM recurring_campaigns WHERE id = ?", (c_id,))
+                continue
+
+            await db.execute(
+                "INSERT INTO scheduled_broadcasts "
+                "(text, image_path, send_at, file_id, drip_minutes, channel_id, created_by) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (text, image_path, next_at, file_id, drip_minutes, channel_id, created_by)
+            )
+            created += 1
+
+            period = timedelta(hours=period_hours)
+            next_dt = datetime.fromisoformat(next_at) + period
+            if next_dt <= now_dt:
+                next_dt += period * ((now_dt - next_dt) // period + 1)
+
+            if next_dt > datetime.fromisoformat(end_at):
+                await db.execute("DELETE FROM recurring_campaigns WHERE id = ?", (c_id,))
+            else:
+                await db.execute(
+                    "UPDATE recurring_campaigns SET next_at = ? WHERE id = ?",
+                    (next_dt.isoformat(), c_id)
+                )
+    return created
+
+
+# --- Очередь доставки рассылок ---
+# Прогресс каждой рассылки хранится в broadcast_deliveries, поэтому после
+# перезапуска рассылка продолжается с того же места. Повторно могут уйти
+# только сообщения, которые были в работе (status = 'sending') в момент падения.
+#
+# При плавной доставке каждый получатель попадает в одну из `waves` волн по
+# мультипликативному хэшу (множитель ≈ 0.618 · (2³¹ − 1)) от user_id и
+# broadcast_id: разбиение детерминировано (после перезапуска волны те же),
+# волны примерно равны, а у каждой рассылки порядок свой.
+_WAVE_HASH = "((user_id + ? * 7919) % 2147483647) * 1327217885 % 2147483647 * ? / 2147483647"
+
+
+@timed_query
+async def start_broadcast_delivery(broadcast_id: int, waves: int = 1) -> str | None:
+    """
+    Один раз заполняет очередь доставки подписчиками канала рассылки.
+
+    :return: Время начала доставки (UTC, сохраняется при первом вызове)
+    """
+    await flush_users()
+    async with _write() as db:
+        cursor = await db.execute(
+            "UPDATE scheduled_broadcasts SET started_at = datetime('now') "
+            "WHERE id = ? AND started_at IS NULL",
+            (broadcast_id,)
+        )
+        if cursor.rowcount:
+            await db.execute(
+                "INSERT OR IGNORE INTO broadcast_deliveries (broadcast_id, user_id, wave) "
+                f"SELECT ?, user_id, {_WAVE_HASH} FROM confirmed_users "
+                "WHERE channel_id = (SELECT channel_id FROM scheduled_broadcasts WHERE id = ?) "
+                "AND status = 'active'",
+                (broadcast_id, broadcast_id, max(1, waves), broadcast_id)
+            )
+        async with db.execute(
+            "SELECT started_at FROM scheduled_broadcasts WHERE id = ?", (broadcast_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+    return row[0] if row else None
+
+
+@timed_query
+async def claim_deliveries(broadcast_id: int, limit: int, max_wave: int = 0) -> list[int]:
+    """Забирает в работу следующую пачку получателей (pending → sending) из волн до max_wave."""
+    async with _write() as db:
+        async with db.execute(
+            "SELECT user_id FROM broadcast_deliveries "
+            "WHERE broadcast_id = ? AND status = 'pending' AND wave <= ? "
+            "ORDER BY wave, user_id LIMIT ?",
+            (broadcast_id, max_wave, limit)
+        ) as cursor:
+            user_ids = [row[0] for row in await cursor.fetchall()]
+        await db.executemany(
+            "UPDATE broadcast_deliveries SET status = 'sending', updated_at = datetime('now') "
+            "WHERE broadcast_id = ? AND user_id = ?",
+            [(broadcast_id, uid) for uid in user_ids]
+        )
+        return user_ids
+
+
+@timed_query
+async def get_delivery_counts(broadcast_id: int) -> tuple[int, int]:
+    """(всего получателей, уже обработано) — для прогресса рассылки."""
+    async with _read() as db:
+        async with db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(status IN ('sent', 'failed')), 0) "
+            "FROM broadcast_deliveries WHERE broadcast_id = ?",
+            (broadcast_id,)
+        ) as cursor:
+            return tuple(await cursor.fetchone())
+
+
+@timed_query
+async def next_pending_wave(broadcast_id: int) -> int | None:
+    """Номер ближайшей волны с неотправленными получателями (None — всё отправлено)."""
+    async with _read() as db:
+        async with db.execute(
+            "SELECT MIN(wave) FROM broadcast_deliveries WHERE broadcast_id = ? AND status = 'pending'",
+            (broadcast_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else None
+
+
+@timed_query
+async def finish_deliveries(broadcast_id: int, sent: list[int], failed: list[int]):
+    """Сохраняет результат отправки пачки (checkpoint)."""
+    rows = [("sent", broadcast_id, uid) for uid in sent] + \
+           [("failed", broadcast_id, uid) for uid in failed]
+    if not rows:
+        return
+    async with _write() as db:
+        await db.executemany(
+            "UPDATE broadcast_deliveries SET status = ?, updated_at = datetime('now') "
+            "WHERE broadcast_id = ? AND user_id = ?",
+            rows
+        )
+
+
+@timed_query
+async def requeue_interrupted_deliveries():
+    """При старте возвращает в очередь доставки, прерванные падением процесса."""
+    async with _write() as db:
+        await db.execute(
+            "UPDATE broadcast_deliveries SET status = 'pending' WHERE status = 'sending'"
+        )
+
+
+# --- Кэш file_id ---
+@timed_query
+async def remember_file_id(image_path: str, file_id: str):
+    """
+    Запоминает file_id картинки для всех записей с тем же image_path.
+    Вызывается после загрузки с диска, то есть когда file_id ещё не был
+    известен или сохранённый перестал приниматься Telegram.
+    """
+    async with _write() as db:
+        for table in ("ads", "preview", "scheduled_broadcasts", "media"):
+            await db.execute(
+                f"UPDATE {table} SET file_id = ? WHERE image_path = ? "
+                "AND (file_id IS NULL OR file_id != ?)",
+                (file_id, image_path, file_id)
+            )
+
+
+# --- Локальные копии медиа ---
+@timed_query
+async def get_media_path(file_unique_id: str) -> str | None:
+    async with _read() as db:
+        async with db.execute(
+            "SELECT image_path FROM media WHERE file_unique_id = ?", (file_unique_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else None
+
+
+@timed_query
+async def get_media_path_by_hash(sha256: str) -> str | None:
+    async with _read() as db:
+        async with db.execute(
+            "SELECT image_path FROM media WHERE sha256 = ? AND image_path IS NOT NULL LIMIT 1",
+            (sha256,)
+        ) as cursor:
+            row = await cursor.fetchone()
+            return row[0] if row else None
+
+
+@timed_query
+async def add_media(file_unique_id: str, file_id: str, image_path: str, sha256: str):
+    """
+    Сохраняет локальную копию картинки и проставляет путь записям, которые
+    ссылаются на неё только по file_id (реклама, превью, рассылки).
+    """
+    async with _write() as db:
+        await db.execute(
+            "INSERT OR REPLACE INTO media (file_unique_id, file_id, image_path, sha256, created_at) "
+            "VALUES (?, ?, ?, ?, datetime('now'))",
+            (file_unique_id, file_id, image_path, sha256)
+        )
+        for table in ("ads", "preview", "scheduled_broadcasts"):
+            await db.execute(
+                f"UPDATE {table} SET image_path = ? WHERE file_id = ? AND image_path IS NULL",
+                (image_path, file_id)
+            )
+
+
+# --- Состояния диалогов админов ---
+# Таблицы хранилищ состояний; имя таблицы подставляется в SQL только из этого списка
+STATE_TABLES = ("admin_states", "admin_channels")
+
+
+@timed_query
+async def get_admin_state(user_id: int, table: str = "admin_states"):
+    assert table in STATE_TABLES
+    async with _read() as db:
+        async with db.execute(
+            f"SELECT state, updated_at FROM {table} WHERE user_id = ?", (user_id,)
+        ) as cursor:
+            return await cursor.fetchone()
+
+
+@timed_query
+async def set_admin_state(user_id: int, state: str, updated_at: float, table: str = "admin_states"):
+    assert table in STATE_TABLES
+    async with _write() as db:
+        await db.execute(
+            f"REPLACE INTO {table} (user_id, state, updated_at) VALUES (?, ?, ?)",
+            (user_id, state, updated_at)
+        )
+
+
+@timed_query
+async def delete_admin_state(user_id: int, table: str = "admin_states"):
+    assert table in STATE_TABLES
+    async with _write() as db:
+        await db.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+
+
+@timed_query
+async def purge_admin_states(older_than: float, table: str = "admin_states"):
+    assert table in STATE_TABLES
+    async with _write() as db:
+        await db.execute(f"DELETE FROM {table} WHERE updated_at < ?", (older_than,))
+
+
+# --- Заявки на вступление ---
+@timed_query
+async def add_join_request(user_id: int, chat_id: int):
+    async with _write() as db:
+        await db.execute(
+            "REPLACE INTO join_requests (user_id, chat_id, requested_at) VALUES (?, ?, datetime('now'))",
+            (user_id, chat_id)
+        )
+
+
+@timed_query
+async def get_join_requests(user_id: int) -> list[int]:
+    """Каналы, в которые у пользователя есть необработанная заявка."""
+    async with _read() as db:
+        async with db.execute("SELECT chat_id FROM join_requests WHERE user_id = ?", (user_id,)) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+
+@timed_query
+async def remove_join_requests(requests: list[tuple[int, int]]):
+    """Удаляет обработанные заявки: список (user_id, chat_id)."""
+    if not requests:
+        return
+    async with _write() as db:
+        await db.executemany(
+            "DELETE FROM join_requests WHERE user_id = ? AND chat_id = ?",
+            requests
+        )
+
+
+@timed_query
+async def get_confirmed_join_requests(limit: int, chat_ids: list[int]) -> list[tuple[int, int]]:
+    """Пачка заявок в каналы chat_ids от пользователей, подтвердивших возраст в этом канале."""
+    await flush_users()
+    if not chat_ids:
+        return []
+    placeholders = ",".join("?" * len(chat_ids))
+    async with _read() as db:
+        async with db.execute(
+            "SELECT j.user_id, j.chat_id FROM join_requests j "
+            "JOIN confirmed_users c ON c.channel_id = j.chat_id AND c.user_id = j.user_id "
+            f"WHERE j.chat_id IN ({placeholders}) AND c.status = 'active' "
+            "ORDER BY j.user_id LIMIT ?",
+            (*chat_ids, limit)
+        ) as cursor:
+            return await cursor.fetchall()
+
+
+# --- Пул ссылок-приглашений ---
+# expires_at хранится как isoformat() в UTC, как и send_at у рассылок
+@timed_query
+async def add_invite_link(chat_id: int, invite_link: str, expires_at: str):
+    async with _write() as db:
+        await db.execute(
+            "INSERT OR IGNORE INTO invite_links (invite_link, chat_id, created_at, expires_at) "
+            "VALUES (?, ?, datetime('now'), ?)",
+            (invite_link, chat_id, expires_at)
+        )
+
+
+@timed_query
+async def take_invite_link(chat_id: int, valid_after: str) -> str | None:
+    """Забирает из пула ссылку, действующую дольше valid_after (ссылка удаляется)."""
+    async with _write() as db:
+        async with db.execute(
+            "SELECT invite_link FROM invite_links WHERE chat_id = ? AND expires_at > ? "
+            "ORDER BY expires_at LIMIT 1",
+            (chat_id, valid_after)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        await db.execute("DELETE FROM invite_links WHERE invite_link = ?", (row[0],))
+        return row[0]
+
+
+@timed_query
+async def count_invite_links(chat_id: int, valid_after: str) -> int:
+    async with _read() as db:
+        async with db.execute(
+            "SELECT COUNT(*) FROM invite_links WHERE chat_id = ? AND expires_at > ?",
+            (chat_id, valid_after)
+        ) as cursor:
+            return (await cursor.fetchone())[0]
+
+
+@timed_query
+async def purge_invite_links(valid_after: str):
+    """Удаляет ссылки, срок которых истекает раньше valid_after."""
+    async with _write() as db:
+        await db.execute("DELETE FROM invite_links WHERE expires_at <= ?", (valid_after,))
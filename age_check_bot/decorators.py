@@ -1,3 +1,4 @@
+import functools
 from telegram import Update
 from telegram.ext import ContextTypes
 from db import is_admin
@@ -7,6 +8,7 @@ def admin_only(func):
     """
     Декоратор: разрешает выполнение только администраторам.
     """
+    @functools.wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         if await is_admin(user_id):
@@ -0,0 +1,101 @@
+"""🔗 invite_pool.py — пул заранее созданных одноразовых ссылок-приглашений.
+
+У каждого канала из CHANNELS в режиме invite_link свой пул; фоновая задача
+пула держит в SQLite запас ссылок для своего канала (в режиме approve ссылка —
+редкий запасной путь и создаётся на лету):
+1. Когда запас опускается ниже INVITE_POOL_LOW, пул пополняется до
+   INVITE_POOL_HIGH — по одной ссылке с паузой, через общий лимит API;
+2. Ссылки создаются со сроком действия и удаляются из пула заранее,
+   за SAFETY_MARGIN до истечения;
+3. Подтверждение возраста берёт готовую ссылку без обращения к API.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from telegram import Bot
+
+from broadcast import engine
+from config import (
+    CHANNELS,
+    INVITE_POOL_LOW,
+    INVITE_POOL_HIGH,
+    INVITE_LINK_TTL_HOURS,
+    INVITE_POOL_REFILL_INTERVAL,
+)
+from db import add_invite_link, take_invite_link, count_invite_links, purge_invite_links
+from log import get_logger
+
+log = get_logger("invite_pool")
+
+# Ссылки, которым осталось жить меньше этого, пользователю не выдаются
+SAFETY_MARGIN = timedelta(hours=1)
+# Как часто пул перепроверяется без внешних событий (истечение ссылок)
+CHECK_INTERVAL = 600.0
+
+
+class InviteLinkPool:
+    def __init__(self, chat_id: int, low: int = INVITE_POOL_LOW,
+                 high: int = INVITE_POOL_HIGH, ttl_hours: int = INVITE_LINK_TTL_HOURS):
+        self.chat_id = chat_id
+        self.low = low
+        self.high = max(high, low)
+        self.ttl = timedelta(hours=ttl_hours)
+        self._refill = asyncio.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return self.high > 0
+
+    @staticmethod
+    def _valid_after() -> str:
+        return (datetime.utcnow() + SAFETY_MARGIN).isoformat()
+
+    async def take(self) -> str | None:
+        """Готовая ссылка из пула или None, если пул пуст или выключен."""
+        if not self.enabled:
+            return None
+        link = await take_invite_link(self.chat_id, self._valid_after())
+        if link is None or await count_invite_links(self.chat_id, self._valid_after()) < self.low:
+            self._refill.set()
+        return link
+
+    async def _create_link(self, bot: Bot) -> None:
+        expires_at = datetime.utcnow() + self.ttl
+        invite = await engine.call(
+            bot.create_chat_invite_link,
+            chat_id=self.chat_id,
+            member_limit=1,
+            expire_date=expires_at,
+            creates_join_request=False,
+        )
+        await add_invite_link(self.chat_id, invite.invite_link, expires_at.isoformat())
+
+    async def run(self, bot: Bot) -> None:
+        if not self.enabled:
+            return
+        while True:
+            self._refill.clear()
+            await purge_invite_links(self._valid_after())
+
+            count = await count_invite_links(self.chat_id, self._valid_after())
+            if count < self.low:
+                log.info("Пополнение пула ссылок",
+                         extra={"chat_id": self.chat_id, "count": count, "target": self.high})
+                while count < self.high:
+                    try:
+                        await self._create_link(bot)
+                        count += 1
+                    except Exception as e:
+                        log.error("Ошибка создания ссылки", extra={"chat_id": self.chat_id, "error": str(e)})
+                        break
+                    await asyncio.sleep(INVITE_POOL_REFILL_INTERVAL)
+
+            try:
+                await asyncio.wait_for(self._refill.wait(), CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+
+invite_pools = {chat_id: InviteLinkPool(chat_id)
+                for chat_id, channel in CHANNELS.items() if channel.join_mode == "invite_link"}
@@ -0,0 +1,94 @@
+"""📝 log.py — неблокирующее структурированное логирование.
+
+Обработчики и рассылки только кладут запись в очередь (QueueHandler),
+а форматирование и запись в stdout выполняет отдельный поток
+(QueueListener). Так медленный stdout (например, лог-драйвер Docker)
+не отнимает время у event loop.
+
+Формат — JSON-строка на запись: время, уровень, модуль, сообщение и
+дополнительные поля из extra={...}. LOG_FORMAT=text — читаемый вид для
+локальной отладки.
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from datetime import datetime, timezone
+
+from config import LOG_LEVEL, LOG_FORMAT
+
+# Атрибуты LogRecord, которые не считаются пользовательскими полями
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: logging.handlers.QueueListener | None = None
+_output: logging.Handler | None = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке.
+
+    Стандартный prepare() форматирует запись до постановки в очередь, то есть
+    в event loop. Очередь здесь внутрипроцессная, поэтому запись можно
+    передать как есть — её отформатирует поток QueueListener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """Настраивает корневой логгер; вызывается один раз при старте."""
+    global _listener, _output
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    if fmt == "text":
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+    else:
+        output.setFormatter(JsonFormatter())
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [_DeferredQueueHandler(records)]
+    root.setLevel(level.upper())
+    # Подробные логи httpx о каждом запросе к Bot API не нужны
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _output = output
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Дописывает очередь записей и останавливает поток логирования.
+
+    Записи после остановки (уже без event loop) пишутся напрямую.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        logging.getLogger().handlers[:] = [_output]
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(name)
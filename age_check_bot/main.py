@@ -1,6 +1,6 @@
 import asyncio
 import os
-from datetime import datetime
+import signal
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -9,117 +9,154 @@ from telegram.ext import (
     ChatJoinRequestHandler,
     filters,
 )
-from config import BOT_TOKEN, MEDIA_FOLDER
+from config import (
+    BOT_TOKEN,
+    BOT_API_BASE_URL,
+    MEDIA_FOLDER,
+    CONCURRENT_UPDATES,
+    RUN_MODE,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_URL,
+    WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS,
+)
 from db import (
+    open_db,
+    close_db,
     init_db,
+    load_admins,
+    load_unreachable_users,
     add_admin,
-    get_scheduled_broadcasts,
-    remove_scheduled_broadcast
+    requeue_interrupted_deliveries,
 )
 from bot_handlers import (
+    track_user_activity,
     start,
-    confirm_age,
     handle_text_buttons,
-    handle_photo_with_caption
+    handle_photo_with_caption,
+    stop_instant_broadcasts,
 )
 from admin_handlers import (
     admin_panel,
     admin_inline_handler
 )
 from chat_join_handler import handle_join_request
-from utils import send_ad_to_user
-
-
-async def process_scheduled_broadcasts(app: Application):
-
-    while True:
-        now = datetime.utcnow()
-        scheduled = await get_scheduled_broadcasts()
-        print(f"[Scheduler] Найдено {len(scheduled)} запланированных рассылок")
-
-        for b_id, text, image_path, send_at in scheduled:
-            try:
-                send_at_dt = datetime.fromisoformat(send_at)
-            except Exception as e:
-                print(f"[Scheduler] ❌ Ошибка парсинга времени: {e}")
-                continue
+from scheduler import BroadcastScheduler
+from invite_pool import invite_pools
+from log import get_logger, setup_logging, shutdown_logging
+from metrics import InstrumentedRequest, instrument_handler, start_metrics_server
+
+log = get_logger("main")
+
+
+def build_application(base_url: str = BOT_API_BASE_URL) -> Application:
+    """Создаёт Application со всеми обработчиками (используется и в нагрузочных тестах)."""
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .request(InstrumentedRequest(connection_pool_size=256))
+    )
+    if base_url:
+        base_url = base_url.rstrip("/")
+        builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+    app = builder.build()
+
+    # Активность пользователя (до остальных обработчиков)
+    app.add_handler(MessageHandler(
+        filters.ChatType.PRIVATE, instrument_handler(track_user_activity)), group=-1)
 
-            if send_at_dt <= now:
-                get_confirmed_users = app.bot_data.get("get_confirmed_users")
-                if not get_confirmed_users:
-                    print("❗ get_confirmed_users не найден в bot_data")
-                    continue
+    # Команды
+    app.add_handler(CommandHandler("start", instrument_handler(start)))
 
-                users = await get_confirmed_users()
-                print(
-                    f"[Broadcast #{b_id}] Отправка {len(users)} пользователям")
+    # Админ панель
+    app.add_handler(CommandHandler("admin", instrument_handler(admin_panel)))
+    app.add_handler(CallbackQueryHandler(instrument_handler(admin_inline_handler)))
 
-                for uid in users:
-                    try:
-                        await send_ad_to_user(app, uid, text, image_path)
-                        print(f"[Broadcast #{b_id}] ✅ Отправлено {uid}")
-                        await asyncio.sleep(0.05)
-                    except Exception as e:
-                        print(f"[Broadcast #{b_id}] ⚠️ Ошибка для {uid}: {e}")
+    # Сообщения
+    app.add_handler(MessageHandler(
+        filters.TEXT & ~filters.COMMAND, instrument_handler(handle_text_buttons)))
+    app.add_handler(MessageHandler(
+        filters.PHOTO & filters.CAPTION, instrument_handler(handle_photo_with_caption)))
 
-                await remove_scheduled_broadcast(b_id)
-                print(f"[Broadcast #{b_id}] 🧹 Удалено из базы")
+    # Join Request
+    app.add_handler(ChatJoinRequestHandler(instrument_handler(handle_join_request)))
 
-        await asyncio.sleep(10)
+    return app
 
 
 async def main():
+    setup_logging()
+    # docker stop шлёт SIGTERM: останавливаемся так же, как по Ctrl+C, чтобы
+    # finally дописал буфер подтверждений и сохранил прогресс рассылок
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass  # Windows: обработчики сигналов в event loop не поддерживаются
     if not os.path.exists(MEDIA_FOLDER):
         os.makedirs(MEDIA_FOLDER)
 
+    await open_db()
     await init_db()
+    await load_admins()
+    await load_unreachable_users()
+    await requeue_interrupted_deliveries()
     await add_admin(5734739119)  # ⛳ Укажи свой ID админа
 
-    app = Application.builder().token(BOT_TOKEN).build()
+    app = build_application()
 
-    # 👇 Установка ссылки на функцию получения подтверждённых пользователей
-    app.bot_data["get_confirmed_users"] = __import__("db").get_confirmed_users
-
-    # Команды
-    app.add_handler(CommandHandler("start", start))
-
-    # Админ панель
-    app.add_handler(CommandHandler("admin", admin_panel))
-    app.add_handler(CallbackQueryHandler(admin_inline_handler))
-
-    # Сообщения
-    app.add_handler(MessageHandler(
-        filters.TEXT & ~filters.COMMAND, handle_text_buttons))
-    app.add_handler(MessageHandler(
-        filters.PHOTO & filters.CAPTION, handle_photo_with_caption))
-
-    # Подтверждение возраста
-    app.add_handler(MessageHandler(
-        filters.TEXT & filters.Regex("Мне есть 18"), confirm_age))
-
-    # Join Request
-    app.add_handler(ChatJoinRequestHandler(handle_join_request))
-
-    print("✅ Бот запущен...")
+    log.info("Бот запущен", extra={"run_mode": RUN_MODE})
 
     async with app:
-        # Запуск фона: проверка отложенных рассылок
-        asyncio.create_task(process_scheduled_broadcasts(app))
+        # Запуск фона: планировщик отложенных рассылок
+        scheduler = BroadcastScheduler(app.bot)
+        scheduler_task = asyncio.create_task(scheduler.run())
+        # Фоновое пополнение пулов ссылок-приглашений (по пулу на канал)
+        pool_tasks = [asyncio.create_task(pool.run(app.bot)) for pool in invite_pools.values()]
+
+        metrics_server = await start_metrics_server()
 
         await app.start()
-        await app.updater.start_polling()
+        if RUN_MODE == "webhook":
+            await app.updater.start_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET or None,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+            log.info("Webhook слушает", extra={
+                "listen": WEBHOOK_LISTEN, "port": WEBHOOK_PORT, "path": WEBHOOK_PATH})
+        else:
+            await app.updater.start_polling()
         try:
             while True:
                 await asyncio.sleep(1)
         except asyncio.CancelledError:
-            print("🛑 Бот остановлен.")
+            log.info("Бот остановлен")
         finally:
+            # Фоновые задачи и идущие доставки останавливаются до закрытия базы:
+            # их последняя запись (checkpoint) должна успеть в открытую базу
+            background = [scheduler_task, *pool_tasks]
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+            await scheduler.stop()
+            await stop_instant_broadcasts()
             await app.updater.stop()
             await app.stop()
+            if metrics_server:
+                metrics_server.close()
+            await close_db()
+            shutdown_logging()
 
 
 if __name__ == "__main__":
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
-        print("⛔ Прерывание от пользователя")
+        log.info("Прерывание от пользователя")
+        shutdown_logging()
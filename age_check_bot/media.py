@@ -0,0 +1,73 @@
+"""🖼 media.py — приём картинок, загруженных админами.
+
+Основная ссылка на картинку — file_id Telegram: по нему фото рассылается
+без чтения с диска и повторной загрузки. Поэтому приём:
+1. Сразу возвращает file_id, ничего не скачивая;
+2. Если уже есть локальная копия этой картинки (по file_unique_id) —
+   возвращает и её путь;
+3. Локальную копию создаёт только при MEDIA_LOCAL_COPY=1 и только в фоне,
+   после ответа админу;
+4. Одинаковые файлы хранятся один раз: имя файла — file_unique_id, а
+   повторно загруженная картинка с тем же содержимым (sha256) ссылается
+   на уже сохранённый файл.
+"""
+
+import asyncio
+import hashlib
+import os
+from dataclasses import dataclass
+
+from telegram import Bot, PhotoSize
+
+from config import MEDIA_FOLDER, MEDIA_LOCAL_COPY
+from db import add_media, get_media_path, get_media_path_by_hash
+from log import get_logger
+
+log = get_logger("media")
+
+
+@dataclass
+class MediaRef:
+    file_id: str
+    file_unique_id: str
+    image_path: str | None = None
+
+
+async def ingest_photo(photo: PhotoSize) -> MediaRef:
+    """Ссылка на загруженное фото; локальная копия — только если уже есть."""
+    image_path = await get_media_path(photo.file_unique_id)
+    if image_path and not os.path.exists(image_path):
+        image_path = None
+    return MediaRef(photo.file_id, photo.file_unique_id, image_path)
+
+
+def store_in_background(bot: Bot, ref: MediaRef, create_task=asyncio.create_task) -> None:
+    """Запускает сохранение локальной копии, если оно включено и нужно."""
+    if MEDIA_LOCAL_COPY and ref.image_path is None:
+        create_task(_store_local(bot, ref))
+
+
+def _write_file(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".part"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+async def _store_local(bot: Bot, ref: MediaRef) -> None:
+    try:
+        file = await bot.get_file(ref.file_id)
+        data = bytes(await file.download_as_bytearray())
+        sha256 = hashlib.sha256(data).hexdigest()
+
+        image_path = await get_media_path_by_hash(sha256)
+        if image_path is None or not os.path.exists(image_path):
+            image_path = os.path.join(MEDIA_FOLDER, f"photo_{ref.file_unique_id}.jpg")
+            await asyncio.to_thread(_write_file, image_path, data)
+
+        await add_media(ref.file_unique_id, ref.file_id, image_path, sha256)
+        log.info("Картинка сохранена", extra={"file_unique_id": ref.file_unique_id, "path": image_path})
+    except Exception as e:
+        log.error("Ошибка сохранения картинки",
+                  extra={"file_unique_id": ref.file_unique_id, "error": str(e)})
@@ -0,0 +1,234 @@
+"""📈 metrics.py — метрики в текстовом формате Prometheus.
+
+Включается переменной METRICS_PORT (0 — выключено). При выключенных
+метриках декораторы возвращают функции без обёрток, а счётчики не пишутся.
+
+Собирается:
+1. Время работы обработчиков апдейтов;
+2. Число и время запросов к базе;
+3. Вызовы Bot API, ошибки и ожидания RetryAfter;
+4. Сообщения рассылок и глубина очереди отправки;
+5. Опоздание планировщика (фактическое время отправки минус send_at).
+"""
+
+import asyncio
+import functools
+import time
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
+
+from config import METRICS_HOST, METRICS_PORT
+from log import get_logger
+
+log = get_logger("metrics")
+
+ENABLED = METRICS_PORT > 0
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LAG_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+_registry: list["_Metric"] = []
+
+
+def _format_labels(labels: tuple, names: tuple) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, labels):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = labels
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        if ENABLED:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self):
+        lines = super().render()
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(labels, self.label_names)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels) -> None:
+        if ENABLED:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+        # labels -> [счётчики по корзинам..., сумма, количество]
+        self._values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        if not ENABLED:
+            return
+        data = self._values.get(labels)
+        if data is None:
+            data = self._values[labels] = [0.0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[i] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    def render(self):
+        lines = super().render()
+        names = self.label_names + ("le",)
+        for labels, data in self._values.items():
+            for bound, count in zip(self.buckets, data):
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (bound,), names)} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + ('+Inf',), names)} {data[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(labels, self.label_names)} {data[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(labels, self.label_names)} {data[-1]}")
+        return lines
+
+
+# --- Метрики ---
+HANDLER_LATENCY = Histogram(
+    "bot_handler_duration_seconds", "Время обработки апдейта", ("handler",))
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", ("handler",))
+DB_QUERY_LATENCY = Histogram(
+    "bot_db_query_duration_seconds", "Время запросов к SQLite", ("query",))
+API_CALLS = Counter(
+    "bot_telegram_api_calls_total", "Вызовы Bot API", ("method",))
+API_ERRORS = Counter(
+    "bot_telegram_api_errors_total", "Ошибки Bot API", ("method", "error"))
+API_RETRY_AFTER = Counter(
+    "bot_telegram_retry_after_seconds_total", "Суммарное ожидание по RetryAfter", ("method",))
+BROADCAST_MESSAGES = Counter(
+    "bot_broadcast_messages_total", "Сообщения рассылок", ("result",))
+BROADCAST_QUEUE_DEPTH = Gauge(
+    "bot_broadcast_queue_depth", "Получатели в очереди движка рассылок")
+SCHEDULER_LAG = Histogram(
+    "bot_scheduler_lag_seconds", "Опоздание старта рассылки относительно send_at",
+    buckets=LAG_BUCKETS)
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Инструментирование ---
+def instrument_handler(func):
+    """Оборачивает обработчик PTB: время выполнения и исключения."""
+    if not ENABLED:
+        return func
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+def timed_query(func):
+    """Оборачивает функцию db.py: число и время запросов."""
+    if not ENABLED:
+        return func
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            DB_QUERY_LATENCY.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest, который считает вызовы Bot API и ошибки по методам."""
+
+    async def post(self, url: str, *args, **kwargs):
+        method = url.rsplit("/", 1)[-1]
+        API_CALLS.inc(method)
+        try:
+            return await super().post(url, *args, **kwargs)
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if isinstance(retry_after, timedelta):
+                retry_after = retry_after.total_seconds()
+            API_ERRORS.inc(method, "RetryAfter")
+            API_RETRY_AFTER.inc(method, amount=float(retry_after))
+            raise
+        except Exception as e:
+            API_ERRORS.inc(method, type(e).__name__)
+            raise
+
+
+# --- HTTP-сервер ---
+async def _handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await reader.readline()
+        # Заголовки не нужны, но их надо дочитать
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        path = parts[1] if len(parts) > 1 else ""
+
+        if path.split("?")[0] == "/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def start_metrics_server() -> asyncio.AbstractServer | None:
+    """Запускает эндпоинт /metrics, если METRICS_PORT задан."""
+    if not ENABLED:
+        return None
+    server = await asyncio.start_server(_handle_connection, METRICS_HOST, METRICS_PORT)
+    log.info("Метрики доступны", extra={"url": f"http://{METRICS_HOST}:{METRICS_PORT}/metrics"})
+    return server
@@ -0,0 +1,83 @@
+"""👤 profiles.py — кэш отображаемых имён пользователей и каналов.
+
+Имена для админских меню берутся через getChat. Чтобы меню открывалось
+быстро, кэш:
+1. Хранит готовую подпись («@username» или «Имя (id)») PROFILE_CACHE_TTL секунд;
+2. Запрашивает недостающие профили параллельно, не более
+   PROFILE_FETCH_CONCURRENCY запросов одновременно;
+3. Объединяет одновременные запросы одного и того же пользователя;
+4. При ошибке показывает id и повторяет запрос не раньше FAILURE_TTL.
+"""
+
+import asyncio
+import time
+
+from telegram import Bot
+
+from config import PROFILE_CACHE_TTL, PROFILE_FETCH_CONCURRENCY
+from log import get_logger
+
+log = get_logger("profiles")
+
+# Неудачный запрос (пользователь не писал боту, сеть) повторяется не чаще
+FAILURE_TTL = 60.0
+
+
+def format_name(user_id: int, username: str | None, full_name: str | None) -> str:
+    if username:
+        return f"@{username}"
+    if full_name:
+        return f"{full_name} ({user_id})"
+    return str(user_id)
+
+
+class ProfileCache:
+    def __init__(self, ttl: float = PROFILE_CACHE_TTL, concurrency: int = PROFILE_FETCH_CONCURRENCY):
+        self.ttl = ttl
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        # user_id -> (истекает в, подпись)
+        self._names: dict[int, tuple[float, str]] = {}
+        self._pending: dict[int, asyncio.Future] = {}
+
+    def _cached(self, user_id: int) -> str | None:
+        item = self._names.get(user_id)
+        if item is None:
+            return None
+        expires_at, name = item
+        if time.monotonic() > expires_at:
+            del self._names[user_id]
+            return None
+        return name
+
+    def invalidate(self, user_id: int) -> None:
+        self._names.pop(user_id, None)
+
+    async def _fetch(self, bot: Bot, user_id: int) -> str:
+        async with self._semaphore:
+            try:
+                chat = await bot.get_chat(user_id)
+                # У каналов нет имени и фамилии — показываем название
+                name, ttl = format_name(user_id, chat.username, chat.full_name or chat.title), self.ttl
+            except Exception as e:
+                log.debug("Профиль недоступен", extra={"user_id": user_id, "error": str(e)})
+                name, ttl = str(user_id), min(self.ttl, FAILURE_TTL)
+        self._names[user_id] = (time.monotonic() + ttl, name)
+        return name
+
+    async def get_name(self, bot: Bot, user_id: int) -> str:
+        name = self._cached(user_id)
+        if name is not None:
+            return name
+        future = self._pending.get(user_id)
+        if future is None:
+            future = self._pending[user_id] = asyncio.ensure_future(self._fetch(bot, user_id))
+            future.add_done_callback(lambda _: self._pending.pop(user_id, None))
+        return await asyncio.shield(future)
+
+    async def get_names(self, bot: Bot, user_ids: list[int]) -> dict[int, str]:
+        """Подписи для списка пользователей; недостающие запрашиваются параллельно."""
+        names = await asyncio.gather(*(self.get_name(bot, uid) for uid in user_ids))
+        return dict(zip(user_ids, names))
+
+
+profiles = ProfileCache()
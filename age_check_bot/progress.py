@@ -0,0 +1,162 @@
+"""📊 progress.py — живой прогресс рассылки в сообщении админу.
+
+Пока идёт рассылка, админу висит одно сообщение, которое:
+1. Редактируется не чаще раза в PROGRESS_EDIT_INTERVAL секунд и только
+   когда доля обработанных выросла на 100/PROGRESS_MAX_EDITS процентов —
+   даже многочасовая плавная рассылка стоит не больше PROGRESS_MAX_EDITS
+   правок (плюс нажатия кнопок);
+2. Показывает отправлено / ошибок / осталось, текущую скорость и ETA;
+3. Несёт кнопки «Пауза» / «Продолжить» и «Отменить» — они управляют
+   рассылкой через BroadcastControl.
+
+Без chat_id (например, у старых кампаний без автора) сообщение не
+отправляется, но управление через control всё равно работает.
+"""
+
+import asyncio
+import secrets
+import time
+from datetime import timedelta
+
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+
+from broadcast import BroadcastControl, BroadcastStats, engine
+from config import PROGRESS_EDIT_INTERVAL, PROGRESS_MAX_EDITS
+from log import get_logger
+
+log = get_logger("progress")
+
+# token -> прогресс идущей рассылки (для кнопок паузы и отмены)
+active_broadcasts: dict[str, "BroadcastProgress"] = {}
+
+
+def _format_eta(seconds: float) -> str:
+    return str(timedelta(seconds=int(seconds)))
+
+
+class BroadcastProgress:
+    def __init__(self, bot: Bot, chat_id: int | None, title: str, total: int, done: int = 0,
+                 control: BroadcastControl | None = None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.title = title
+        self.total = total
+        # Получатели, обработанные до этого запуска (рассылка после перезапуска)
+        self.done = done
+        # Случайный токен: кнопки сообщений до перезапуска не попадут в новую рассылку
+        self.token = secrets.token_hex(4)
+        self.control = control or BroadcastControl()
+        # Прервана остановкой бота (задача отменена) — продолжится после перезапуска
+        self._interrupted = False
+        self._message_id: int | None = None
+        self._last_key: tuple | None = None
+        self._last_count = 0
+        self._last_at = time.monotonic()
+        self._rate = 0.0
+        self._refresh = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    # --- Кнопки ---
+    def pause(self) -> None:
+        self.control.pause()
+        self._refresh.set()
+
+    def resume(self) -> None:
+        self.control.resume()
+        self._refresh.set()
+
+    def cancel(self) -> None:
+        self.control.cancel()
+        self._refresh.set()
+
+    def _keyboard(self) -> InlineKeyboardMarkup:
+        toggle = (InlineKeyboardButton("▶️ Продолжить", callback_data=f"bc_resume_{self.token}")
+                  if self.control.paused else
+                  InlineKeyboardButton("⏸ Пауза", callback_data=f"bc_pause_{self.token}"))
+        return InlineKeyboardMarkup([[
+            toggle, InlineKeyboardButton("⏹ Отменить", callback_data=f"bc_cancel_{self.token}")]])
+
+    # --- Текст ---
+    def _counts(self) -> tuple[int, int]:
+        stats = self.control.stats or BroadcastStats()
+        return stats.sent, stats.failed
+
+    def _render(self, final: bool = False) -> str:
+        sent, failed = self._counts()
+        remaining = max(self.total - self.done - sent - failed, 0)
+        if self._interrupted:
+            status = "⏸ Прервана остановкой бота"
+        elif self.control.cancelled:
+            status = "⏹ Отменена" if final else "⏹ Отменяется…"
+        elif final:
+            status = "✅ Завершена"
+        elif self.control.paused:
+            status = "⏸ На паузе"
+        else:
+            eta = _format_eta(remaining / self._rate) if self._rate > 0 else "—"
+            status = f"⚡ {self._rate:.1f} сообщ./сек, осталось ≈ {eta}"
+        return (f"📤 {self.title}\n"
+                f"✅ Отправлено: {sent}   ❌ Ошибок: {failed}\n"
+                f"⏳ Осталось: {remaining} из {self.total}\n"
+                f"{status}")
+
+    def _update_rate(self) -> None:
+        now = time.monotonic()
+        count = sum(self._counts())
+        if now > self._last_at:
+            self._rate = (count - self._last_count) / (now - self._last_at)
+        self._last_count, self._last_at = count, now
+
+    def _step(self) -> int:
+        """Номер шага прогресса: меняется PROGRESS_MAX_EDITS раз за рассылку."""
+        remaining = self.total - self.done
+        if remaining <= 0:
+            return PROGRESS_MAX_EDITS
+        return int(sum(self._counts()) / remaining * max(1, PROGRESS_MAX_EDITS))
+
+    async def _edit(self, final: bool = False) -> None:
+        if self._message_id is None:
+            return
+        # Скорость и ETA меняются постоянно — правка только при новом шаге или статусе
+        key = (self._step(), self.control.paused, self.control.cancelled)
+        if key == self._last_key and not final:
+            return
+        try:
+            await engine.call(
+                self.bot.edit_message_text, chat_id=self.chat_id, message_id=self._message_id,
+                text=self._render(final), reply_markup=None if final else self._keyboard())
+            self._last_key = key
+        except Exception as e:
+            # "message is not modified" и подобное — прогресс не должен мешать рассылке
+            log.debug("Не удалось обновить прогресс", extra={"token": self.token, "error": str(e)})
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._refresh.wait(), PROGRESS_EDIT_INTERVAL)
+            except asyncio.TimeoutError:
+                self._update_rate()
+            self._refresh.clear()
+            await self._edit()
+
+    # --- Жизненный цикл ---
+    async def __aenter__(self) -> "BroadcastProgress":
+        active_broadcasts[self.token] = self
+        if self.chat_id is not None:
+            try:
+                message = await engine.call(
+                    self.bot.send_message, chat_id=self.chat_id,
+                    text=self._render(), reply_markup=self._keyboard())
+                self._message_id = message.message_id
+                self._last_key = (self._step(), self.control.paused, self.control.cancelled)
+                self._task = asyncio.create_task(self._loop())
+            except Exception as e:
+                log.warning("Не удалось отправить прогресс", extra={"chat_id": self.chat_id, "error": str(e)})
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        active_broadcasts.pop(self.token, None)
+        self._interrupted = exc_type is asyncio.CancelledError
+        if self._task:
+            self._task.cancel()
+        await self._edit(final=True)
@@ -0,0 +1,133 @@
+"""⏰ scheduler.py — планировщик отложенных рассылок.
+
+Вместо опроса всей таблицы по таймеру планировщик:
+1. Забирает из базы только рассылки, время которых уже наступило;
+2. Создаёт очередной запуск повторяющихся кампаний, когда он наступил;
+   каждая рассылка доставляется отдельной задачей, поэтому плавная
+   доставка на несколько часов не задерживает остальные;
+3. Спит ровно до ближайшей следующей рассылки (MIN(send_at) по индексу);
+4. Просыпается раньше, если добавлена рассылка на более раннее время.
+
+Автору рассылки показывается живой прогресс с кнопками паузы и отмены
+(progress.py); отменённая рассылка удаляется так же, как доставленная.
+"""
+
+import asyncio
+from datetime import datetime
+
+from telegram import Bot
+
+from db import (
+    get_due_broadcasts,
+    get_delivery_counts,
+    start_broadcast_delivery,
+    get_next_send_at,
+    materialize_due_campaigns,
+    remove_scheduled_broadcast,
+    set_schedule_listener,
+)
+from log import get_logger
+from metrics import SCHEDULER_LAG
+from progress import BroadcastProgress
+from utils import deliver_broadcast, drip_waves
+
+log = get_logger("scheduler")
+
+# Верхняя граница сна: страховка на случай правок базы в обход бота
+MAX_SLEEP = 3600.0
+# Пауза перед повтором после ошибки в цикле планировщика
+ERROR_BACKOFF = 5.0
+
+
+class BroadcastScheduler:
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        self._next_at: str | None = None
+        # id рассылок, которые сейчас доставляются
+        self._running: set[int] = set()
+        # Ссылки на задачи доставки: event loop держит задачи только слабо
+        self._tasks: set[asyncio.Task] = set()
+        set_schedule_listener(self.notify)
+
+    async def stop(self) -> None:
+        """Прерывает идущие доставки при остановке бота.
+
+        Доставка не отменяется: результаты сохраняются в finally, а оставшиеся
+        получатели будут разосланы после перезапуска.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def notify(self, send_at: str) -> None:
+        """Будит планировщик, если новая рассылка раньше ближайшей известной."""
+        if self._next_at is None or send_at < self._next_at:
+            self._wakeup.set()
+
+    async def _deliver(self, b_id: int, text: str, image_path: str | None,
+                       file_id: str | None, drip_minutes: int,
+                       created_by: int | None) -> None:
+        try:
+            total, done = await get_delivery_counts(b_id)
+            # Итоговую сводку по рассылке пишет движок рассылок
+            async with BroadcastProgress(self.bot, created_by, f"Рассылка #{b_id}", total, done) as progress:
+                await deliver_broadcast(self.bot, b_id, text, image_path, file_id, drip_minutes,
+                                        control=progress.control)
+            await remove_scheduled_broadcast(b_id)
+        except Exception as e:
+            log.error("Ошибка доставки рассылки", extra={"broadcast_id": b_id, "error": str(e)})
+        finally:
+            self._running.discard(b_id)
+
+    async def run(self) -> None:
+        while True:
+            # Сбрасываем событие до запросов, чтобы не потерять notify() во время работы
+            self._wakeup.clear()
+            try:
+                timeout = await self._tick()
+            except Exception as e:
+                # Временная ошибка базы (например, "database is locked") не должна
+                # останавливать планировщик — повторяем после паузы
+                log.error("Ошибка планировщика", extra={"error": str(e)})
+                timeout = ERROR_BACKOFF
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _tick(self) -> float:
+        """Запускает наступившие рассылки; возвращает, сколько спать до следующих."""
+        now = datetime.utcnow().isoformat()
+        await materialize_due_campaigns(now)
+
+        for b_id, text, image_path, send_at, file_id, drip_minutes, created_by in await get_due_broadcasts(now):
+            if b_id in self._running:
+                continue
+            try:
+                lag = (datetime.utcnow() - datetime.fromisoformat(send_at)).total_seconds()
+                SCHEDULER_LAG.observe(lag)
+            except ValueError:
+                lag = None
+            log.info("Начало доставки",
+                     extra={"broadcast_id": b_id, "lag": lag, "drip_minutes": drip_minutes})
+
+            # started_at ставится до запуска задачи, чтобы get_next_send_at её уже не видел
+            await start_broadcast_delivery(b_id, drip_waves(drip_minutes))
+            self._running.add(b_id)
+            task = asyncio.create_task(
+                self._deliver(b_id, text, image_path, file_id, drip_minutes, created_by))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        self._next_at = await get_next_send_at()
+        timeout = MAX_SLEEP
+        if self._next_at is not None:
+            try:
+                delay = (datetime.fromisoformat(self._next_at) - datetime.utcnow()).total_seconds()
+                # Небольшой минимум защищает от холостого цикла при странном формате send_at
+                timeout = min(max(delay, 0.05), MAX_SLEEP)
+            except ValueError as e:
+                log.error("Ошибка парсинга времени", extra={"send_at": self._next_at, "error": str(e)})
+        return timeout
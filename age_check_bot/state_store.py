@@ -0,0 +1,99 @@
+"""🗂 state_store.py — хранилище состояний диалогов админов.
+
+Состояние — строка ("search_ad", "preview_upload", …) или словарь с шагами
+мастера рассылки. Значения должны сериализоваться в JSON (даты — строкой
+isoformat), чтобы оба бэкенда вели себя одинаково.
+
+Бэкенды:
+1. MemoryStateStore — LRU в памяти процесса с ограничением размера и TTL;
+2. SQLiteStateStore — таблица admin_states, общая для нескольких воркеров
+   и переживающая перезапуск.
+
+Независимым хранилищам (например, выбранный канал админа) нужна своя
+таблица из db.STATE_TABLES.
+"""
+
+import abc
+import json
+import time
+from collections import OrderedDict
+
+from config import STATE_BACKEND, STATE_TTL, STATE_MAX_SIZE
+from db import get_admin_state, set_admin_state, delete_admin_state, purge_admin_states
+
+State = str | dict | int
+
+
+class StateStore(abc.ABC):
+    """Интерфейс хранилища: состояние по user_id админа."""
+
+    @abc.abstractmethod
+    async def get(self, user_id: int) -> State | None:
+        ...
+
+    @abc.abstractmethod
+    async def set(self, user_id: int, state: State) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def pop(self, user_id: int) -> None:
+        ...
+
+
+class MemoryStateStore(StateStore):
+    def __init__(self, max_size: int = STATE_MAX_SIZE, ttl: float = STATE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict[int, tuple[float, State]] = OrderedDict()
+
+    async def get(self, user_id: int) -> State | None:
+        item = self._items.get(user_id)
+        if item is None:
+            return None
+        updated_at, state = item
+        if self.ttl > 0 and time.monotonic() - updated_at > self.ttl:
+            del self._items[user_id]
+            return None
+        return state
+
+    async def set(self, user_id: int, state: State) -> None:
+        self._items[user_id] = (time.monotonic(), state)
+        self._items.move_to_end(user_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    async def pop(self, user_id: int) -> None:
+        self._items.pop(user_id, None)
+
+
+class SQLiteStateStore(StateStore):
+    def __init__(self, ttl: float = STATE_TTL, table: str = "admin_states"):
+        self.ttl = ttl
+        self.table = table
+
+    async def get(self, user_id: int) -> State | None:
+        row = await get_admin_state(user_id, self.table)
+        if row is None:
+            return None
+        state, updated_at = row
+        if self.ttl > 0 and time.time() - updated_at > self.ttl:
+            await delete_admin_state(user_id, self.table)
+            return None
+        return json.loads(state)
+
+    async def set(self, user_id: int, state: State) -> None:
+        now = time.time()
+        await set_admin_state(user_id, json.dumps(state, ensure_ascii=False), now, self.table)
+        if self.ttl > 0:
+            await purge_admin_states(now - self.ttl, self.table)
+
+    async def pop(self, user_id: int) -> None:
+        await delete_admin_state(user_id, self.table)
+
+
+def create_state_store(backend: str = STATE_BACKEND, table: str = "admin_states",
+                       ttl: float = STATE_TTL) -> StateStore:
+    """Хранилище выбранного бэкенда; ttl=0 — без срока жизни."""
+    if backend == "sqlite":
+        return SQLiteStateStore(ttl, table=table)
+    return MemoryStateStore(ttl=ttl)
@@ -1,32 +1,254 @@
 """📦 utils.py — утильные функции для Telegram-бота."""
 
+import asyncio
 import os
+from datetime import datetime, timedelta
+from typing import AsyncIterable, Callable, Iterable
+from telegram import Bot
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
+from broadcast import BroadcastControl, BroadcastEngine, BroadcastStats, engine, is_unreachable
+from config import DELIVERY_BATCH_SIZE, DRIP_WAVE_SECONDS
+from log import get_logger
+from db import (
+    remember_file_id,
+    mark_users_unreachable,
+    start_broadcast_delivery,
+    claim_deliveries,
+    finish_deliveries,
+    next_pending_wave,
+)
+
+log = get_logger("utils")
+
+# Сколько недоступных получателей копится перед записью в базу
+UNREACHABLE_FLUSH_SIZE = 100
+
+
+async def _direct_call(func, *args, **kwargs):
+    return await func(*args, **kwargs)
+
+
+async def send_media(
+    bot: Bot,
+    chat_id: int,
+    text: str,
+    image_path: str | None,
+    file_id: str | None = None,
+    limiter: BroadcastEngine | None = None,
+    **kwargs
+) -> str | None:
+    """
+    Отправляет фото с подписью, а если фото нет — обычное текстовое сообщение.
+
+    Если известен file_id — фото отправляется по нему, без чтения с диска и
+    повторной загрузки. После загрузки с диска file_id, который вернул
+    Telegram, сохраняется в базе для следующих отправок.
+
+    :param bot: Бот PTB
+    :param chat_id: Telegram ID получателя
+    :param text: Текст / подпись
+    :param image_path: Путь до изображения (или None)
+    :param file_id: Сохранённый file_id изображения (или None)
+    :param limiter: Движок рассылок, через который идут вызовы API (или None)
+    :return: file_id отправленного фото или None, если фото не отправлялось
+    """
+    call = limiter.call if limiter else _direct_call
+    has_file = bool(image_path and os.path.exists(image_path))
+
+    if file_id:
+        try:
+            await call(bot.send_photo, chat_id=chat_id, photo=file_id, caption=text, **kwargs)
+            return file_id
+        except BadRequest as e:
+            # file_id устарел (например, сменился токен) — грузим заново с диска
+            if not has_file or "file" not in e.message.lower():
+                raise
+
+    if has_file:
+        # Байты, а не файловый объект: при повторе после RetryAfter файл читался бы с конца
+        with open(image_path, 'rb') as f:
+            photo = f.read()
+        message = await call(bot.send_photo, chat_id=chat_id, photo=photo, caption=text, **kwargs)
+        new_file_id = message.photo[-1].file_id
+        await remember_file_id(image_path, new_file_id)
+        return new_file_id
+
+    await call(bot.send_message, chat_id=chat_id, text=text, **kwargs)
+    return None
 
 
 async def send_ad_to_user(
     context: ContextTypes.DEFAULT_TYPE,
     user_id: int,
     text: str,
-    image_path: str | None
-) -> None:
+    image_path: str | None,
+    file_id: str | None = None
+) -> str | None:
     """
     Универсальная отправка рекламного сообщения пользователю.
 
-    Если передан путь к изображению и файл существует — отправляется фото с подписью.
-    В противном случае — обычное текстовое сообщение.
+    Если передан file_id или путь к существующему изображению — отправляется
+    фото с подписью. В противном случае — обычное текстовое сообщение.
 
     :param context: Контекст бота от PTB
     :param user_id: Telegram ID получателя
     :param text: Текст рекламы
     :param image_path: Путь до изображения (или None)
+    :param file_id: Сохранённый file_id изображения (или None)
+    :return: file_id отправленного фото (для следующих отправок)
     """
     try:
-        if image_path and os.path.exists(image_path):
-            with open(image_path, 'rb') as photo:
-                await context.bot.send_photo(chat_id=user_id, photo=photo, caption=text)
-        else:
-            await context.bot.send_message(chat_id=user_id, text=text)
+        return await send_media(context.bot, user_id, text, image_path, file_id, limiter=engine)
     except Exception as e:
-        print(
-            f"[send_ad_to_user] ❌ Ошибка при отправке пользователю {user_id}: {e}")
+        log.warning("Ошибка отправки пользователю", extra={"user_id": user_id, "error": str(e)})
+        if is_unreachable(e):
+            await mark_users_unreachable([user_id])
+        return None
+
+
+async def broadcast_ad(
+    bot: Bot,
+    recipients: Iterable[int] | AsyncIterable[int],
+    text: str,
+    image_path: str | None,
+    file_id: str | None = None,
+    on_result: Callable[[int, bool], None] | None = None,
+    name: str = "instant",
+    control: BroadcastControl | None = None
+) -> BroadcastStats:
+    """
+    Рассылка рекламы списку получателей через общий движок рассылок.
+
+    Если file_id картинки ещё не известен, первое фото загружается с диска
+    один раз, остальные отправки ждут его file_id и идут уже по нему.
+    Получатели с постоянной ошибкой доставки помечаются недоступными и
+    больше не попадают в рассылки.
+
+    :param on_result: Колбэк on_result(user_id, успех) после каждой отправки
+    :param name: Метка рассылки в итоговой записи лога
+    :param control: Пауза и отмена рассылки (или None)
+    :return: Статистика рассылки (в stats.file_id — file_id картинки)
+    """
+    upload_lock = asyncio.Lock()
+    needs_upload = not file_id and bool(image_path and os.path.exists(image_path))
+    unreachable: list[int] = []
+
+    async def send(user_id: int):
+        nonlocal file_id, needs_upload
+        if needs_upload:
+            async with upload_lock:
+                if needs_upload:
+                    file_id = await send_media(bot, user_id, text, image_path, limiter=engine)
+                    needs_upload = False
+                    return
+        await send_media(bot, user_id, text, image_path, file_id, limiter=engine)
+
+    async def send_one(user_id: int):
+        try:
+            await send(user_id)
+        except Exception as e:
+            if is_unreachable(e):
+                unreachable.append(user_id)
+                if len(unreachable) >= UNREACHABLE_FLUSH_SIZE:
+                    batch = unreachable[:]
+                    unreachable.clear()
+                    await mark_users_unreachable(batch)
+            raise
+
+    try:
+        stats = await engine.run(recipients, send_one, on_result, name=name, control=control)
+    finally:
+        await mark_users_unreachable(unreachable)
+    stats.file_id = file_id
+    return stats
+
+
+def drip_waves(drip_minutes: int) -> int:
+    """На сколько волн делится окно плавной доставки (1 — отправка сразу)."""
+    return max(1, drip_minutes * 60 // DRIP_WAVE_SECONDS) if drip_minutes > 0 else 1
+
+
+async def deliver_broadcast(
+    bot: Bot,
+    broadcast_id: int,
+    text: str,
+    image_path: str | None,
+    file_id: str | None = None,
+    drip_minutes: int = 0,
+    control: BroadcastControl | None = None
+) -> BroadcastStats:
+    """
+    Доставляет запланированную рассылку через очередь broadcast_deliveries.
+
+    Получатели забираются из базы пачками по DELIVERY_BATCH_SIZE, результаты
+    сохраняются перед каждой следующей пачкой, так что после перезапуска
+    рассылка продолжается с места остановки.
+
+    При drip_minutes > 0 рассылка растягивается на окно: получатели разбиты
+    на волны по DRIP_WAVE_SECONDS, волна k открывается в started_at + k·длина
+    волны. Отсчёт идёт от начала доставки, а не от send_at: запуск кампании,
+    созданный с опозданием после простоя, всё равно растягивается на всё окно.
+    Пиковая нагрузка на API — одна волна, а не вся аудитория.
+
+    После отмены через control новые пачки не забираются; уже забранные,
+    но не отправленные получатели удаляются вместе с рассылкой.
+    """
+    waves = drip_waves(drip_minutes)
+    wave_len = timedelta(minutes=drip_minutes) / waves
+    # started_at хранится в базе, поэтому после перезапуска волны не сдвигаются
+    started_at = await start_broadcast_delivery(broadcast_id, waves)
+    start = datetime.fromisoformat(started_at) if started_at else datetime.utcnow()
+
+    def open_wave() -> int:
+        return 0 if waves == 1 else int((datetime.utcnow() - start) / wave_len)
+
+    sent: list[int] = []
+    failed: list[int] = []
+    # Забрано из очереди, но результат ещё не получен
+    in_flight = 0
+
+    async def checkpoint():
+        done_sent, done_failed = sent[:], failed[:]
+        sent.clear()
+        failed.clear()
+        await finish_deliveries(broadcast_id, done_sent, done_failed)
+
+    def on_result(user_id: int, ok: bool):
+        nonlocal in_flight
+        in_flight -= 1
+        (sent if ok else failed).append(user_id)
+
+    async def recipients():
+        nonlocal in_flight
+        while not (control and control.cancelled):
+            await checkpoint()
+            batch = await claim_deliveries(broadcast_id, DELIVERY_BATCH_SIZE, open_wave())
+            in_flight += len(batch)
+            if not batch:
+                next_wave = await next_pending_wave(broadcast_id) if waves > 1 else None
+                if next_wave is None:
+                    return
+                # Текущие волны разосланы. Перед ожиданием следующей дожидаемся
+                # идущих отправок и сохраняем их результаты: иначе они простояли бы
+                # в 'sending' всю паузу и после сбоя ушли бы повторно
+                while in_flight > 0 and not (control and control.cancelled):
+                    await asyncio.sleep(0.1)
+                await checkpoint()
+                opens_at = start + wave_len * next_wave
+                while not (control and control.cancelled):
+                    delay = (opens_at - datetime.utcnow()).total_seconds()
+                    if delay <= 0:
+                        break
+                    # Короткими шагами, чтобы отмена не ждала открытия волны
+                    await asyncio.sleep(min(delay, 1.0))
+                continue
+            for user_id in batch:
+                yield user_id
+
+    try:
+        return await broadcast_ad(
+            bot, recipients(), text, image_path, file_id, on_result,
+            name=f"scheduled#{broadcast_id}", control=control)
+    finally:
+        await checkpoint()
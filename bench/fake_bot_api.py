@@ -0,0 +1,174 @@
+"""🧪 fake_bot_api.py — локальная подмена Telegram Bot API для нагрузочных тестов.
+
+Сервер на asyncio без внешних зависимостей:
+1. Принимает запросы вида /bot<token>/<method> (JSON, form и multipart);
+2. Записывает каждый вызов (метод, chat_id, время);
+3. Отвечает с заданной задержкой и правдоподобным телом ответа;
+4. Каждый N-й вызов может вернуть 429 Too Many Requests с retry_after.
+"""
+
+import asyncio
+import itertools
+import json
+import re
+import time
+from dataclasses import dataclass, field
+from urllib.parse import parse_qs
+
+FAKE_BOT = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+FAKE_PHOTO = [{"file_id": "fake-photo-id", "file_unique_id": "fake-photo", "width": 1, "height": 1}]
+
+
+@dataclass
+class Call:
+    method: str
+    chat_id: int | None
+    at: float
+
+
+@dataclass
+class FakeBotApi:
+    host: str = "127.0.0.1"
+    port: int = 8081
+    latency: float = 0.0
+    retry_after_every: int = 0
+    retry_after: int = 1
+    calls: list[Call] = field(default_factory=list)
+
+    def __post_init__(self):
+        self._server: asyncio.AbstractServer | None = None
+        self._counter = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def count(self, method: str) -> int:
+        return sum(1 for call in self.calls if call.method == method)
+
+    @property
+    def throttled(self) -> int:
+        return self.count("429")
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    # --- HTTP ---
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                path = request_line.decode("latin-1").split()[1]
+                method = path.rstrip("/").rsplit("/", 1)[-1]
+                params = _parse_params(headers.get("content-type", ""), body)
+
+                status, payload = await self._respond(method, params)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, method: str, params: dict) -> tuple[str, dict]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = _to_int(params.get("chat_id"))
+        if method == "getUpdates":
+            # Имитация long polling без апдейтов
+            await asyncio.sleep(1)
+            return "200 OK", {"ok": True, "result": []}
+
+        if self.retry_after_every and next(self._counter) % self.retry_after_every == 0:
+            self.calls.append(Call("429", chat_id, time.monotonic()))
+            return "429 Too Many Requests", {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+
+        self.calls.append(Call(method, chat_id, time.monotonic()))
+        return "200 OK", {"ok": True, "result": self._result(method, chat_id, params)}
+
+    def _result(self, method: str, chat_id: int | None, params: dict):
+        chat = {"id": chat_id or 0, "type": "private", "first_name": "User"}
+        if method == "getMe":
+            return FAKE_BOT
+        if method in ("sendMessage", "editMessageText", "sendPhoto"):
+            message = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": chat,
+                "from": FAKE_BOT,
+            }
+            if method == "sendPhoto":
+                message["photo"] = FAKE_PHOTO
+                message["caption"] = params.get("caption", "")
+            else:
+                message["text"] = params.get("text", "")
+            return message
+        if method == "createChatInviteLink":
+            return {
+                "invite_link": f"https://t.me/+fake{next(self._message_ids)}",
+                "creator": FAKE_BOT,
+                "creates_join_request": False,
+                "is_primary": False,
+                "is_revoked": False,
+                "member_limit": 1,
+            }
+        if method == "getChat":
+            return {
+                **chat,
+                "accent_color_id": 0,
+                "max_reaction_count": 0,
+                "accepted_gift_types": {
+                    "unlimited_gifts": False,
+                    "limited_gifts": False,
+                    "unique_gifts": False,
+                    "premium_subscription": False,
+                },
+            }
+        # setWebhook, deleteWebhook, approveChatJoinRequest, answerCallbackQuery, …
+        return True
+
+
+def _to_int(value) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_params(content_type: str, body: bytes) -> dict:
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        return {k: v[0] for k, v in parse_qs(body.decode()).items()}
+    if content_type.startswith("multipart/form-data"):
+        # Файлы не разбираем — достаточно текстовых полей
+        text = body.decode("utf-8", errors="ignore")
+        return dict(re.findall(r'name="([^"]+)"\r\n(?:[^\r\n]+\r\n)*\r\n([^\r]*)\r\n', text))
+    return {}
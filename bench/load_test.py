@@ -0,0 +1,198 @@
+"""🧪 load_test.py — сквозной нагрузочный тест бота на фейковом Bot API.
+
+Запуск из корня репозитория:
+
+    python bench/load_test.py --users 1000 --latency 0.02 --retry-after-every 500
+
+Сценарии:
+1. join — шторм из N заявок на вступление (handle_join_request);
+2. confirm — N одновременных нажатий «Мне есть 18»;
+3. broadcast — рассылка на N подтверждённых пользователей.
+
+Для каждого сценария печатаются p50/p99 задержки обработки апдейта
+(для рассылки — время от старта до доставки получателю), пропускная
+способность и число вызовов Bot API. В confirm учитываются и вызовы
+отложенных задач (ссылка, предупреждение): сценарий ждёт их завершения.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "age_check_bot"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotApi  # noqa: E402
+
+CHANNEL_ID = -1001234567890
+FIRST_USER_ID = 1_000_000
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def report(name: str, latencies: list[float], elapsed: float, api_calls: int, throttled: int):
+    count = len(latencies)
+    print(
+        f"{name:<10} n={count:<6} "
+        f"p50={percentile(latencies, 0.50) * 1000:7.1f} мс  "
+        f"p99={percentile(latencies, 0.99) * 1000:7.1f} мс  "
+        f"{count / elapsed if elapsed else 0:8.1f} апд./сек  "
+        f"API={api_calls} (429: {throttled})"
+    )
+
+
+async def process_all(app, updates, concurrency: int) -> tuple[list[float], float]:
+    """Прогоняет апдейты через обработчики, не более concurrency одновременно."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def process(update):
+        async with semaphore:
+            started = time.perf_counter()
+            await app.process_update(update)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(process(update) for update in updates))
+    return latencies, time.perf_counter() - started
+
+
+def join_request_update(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "chat_join_request": {
+            "chat": {"id": CHANNEL_ID, "type": "channel", "title": "Bench"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+            "user_chat_id": user_id,
+            "date": int(time.time()),
+        },
+    }
+
+
+def confirm_update(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": "User"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+            "text": "Мне есть 18",
+        },
+    }
+
+
+async def wait_for_jobs(app, timeout: float = 60.0):
+    """Ждёт отложенные задачи JobQueue (ссылка, предупреждение), чтобы их вызовы
+    Bot API попали в свой сценарий, а не в следующий."""
+    from bot_handlers import INVITE_LINK_DELAY, MODERATION_WARNING_DELAY
+
+    # Задача предупреждения ставится из задачи ссылки — очередь может ненадолго опустеть
+    await asyncio.sleep(INVITE_LINK_DELAY + MODERATION_WARNING_DELAY)
+    deadline = time.perf_counter() + timeout
+    while app.job_queue.jobs() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    # Последние запущенные задачи ещё могут ждать ответа API
+    await asyncio.sleep(1.0)
+
+
+async def run(args):
+    fake = FakeBotApi(
+        port=args.port,
+        latency=args.latency,
+        retry_after_every=args.retry_after_every,
+        retry_after=args.retry_after,
+    )
+    await fake.start()
+
+    # Настройки бота читаются из окружения при импорте config
+    tmp_dir = tempfile.mkdtemp(prefix="age_check_bench_")
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCH")
+    os.environ["CHANNEL_ID"] = str(CHANNEL_ID)
+    os.environ["DB_PATH"] = os.path.join(tmp_dir, "bench.sqlite")
+    os.environ["BOT_API_BASE_URL"] = fake.base_url
+    os.environ["BROADCAST_RATE"] = str(args.rate)
+
+    from telegram import Update
+    import db
+    from main import build_application
+    from utils import broadcast_ad
+
+    await db.open_db()
+    await db.init_db()
+    await db.load_admins()
+
+    app = build_application()
+    await app.initialize()
+    await app.start()
+
+    user_ids = [FIRST_USER_ID + i for i in range(args.users)]
+    scenarios = args.scenarios.split(",")
+    try:
+        if "join" in scenarios:
+            before = len(fake.calls)
+            updates = [Update.de_json(join_request_update(i, uid), app.bot)
+                       for i, uid in enumerate(user_ids)]
+            latencies, elapsed = await process_all(app, updates, args.concurrency)
+            report("join", latencies, elapsed, len(fake.calls) - before, fake.throttled)
+
+        if "confirm" in scenarios:
+            before = len(fake.calls)
+            updates = [Update.de_json(confirm_update(i, uid), app.bot)
+                       for i, uid in enumerate(user_ids)]
+            latencies, elapsed = await process_all(app, updates, args.concurrency)
+            await wait_for_jobs(app)
+            report("confirm", latencies, elapsed, len(fake.calls) - before, fake.throttled)
+
+        if "broadcast" in scenarios:
+            async with db._write() as conn:
+                await conn.executemany(
+                    "INSERT OR IGNORE INTO confirmed_users (channel_id, user_id, confirmed_at) "
+                    "VALUES (?, ?, datetime('now'))",
+                    [(CHANNEL_ID, uid) for uid in user_ids]
+                )
+            before = len(fake.calls)
+            latencies = []
+            started = time.perf_counter()
+
+            def on_result(user_id: int, ok: bool):
+                latencies.append(time.perf_counter() - started)
+
+            stats = await broadcast_ad(
+                app.bot, db.iter_confirmed_users(), "🧪 bench", None, on_result=on_result)
+            elapsed = time.perf_counter() - started
+            report("broadcast", latencies, elapsed, len(fake.calls) - before, fake.throttled)
+            print(f"{'':<10} отправлено {stats.sent}, ошибок {stats.failed}, "
+                  f"{stats.rate:.1f} сообщ./сек")
+    finally:
+        await app.stop()
+        await app.shutdown()
+        await db.close_db()
+        await fake.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на фейковом Bot API")
+    parser.add_argument("--users", type=int, default=1000, help="Число пользователей в сценарии")
+    parser.add_argument("--scenarios", default="join,confirm,broadcast")
+    parser.add_argument("--concurrency", type=int, default=32, help="Параллельных апдейтов")
+    parser.add_argument("--latency", type=float, default=0.02, help="Задержка ответа API, сек")
+    parser.add_argument("--retry-after-every", type=int, default=0,
+                        help="Каждый N-й вызов отвечает 429 (0 — никогда)")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответе 429")
+    parser.add_argument("--rate", type=float, default=1000, help="BROADCAST_RATE для теста")
+    parser.add_argument("--port", type=int, default=8081)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()